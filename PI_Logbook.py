@@ -9,8 +9,12 @@ from pathlib import Path
 from XPPython3 import xp
 
 from logbook.aircraft import Aircraft
+from logbook.airports import BackgroundIndex
+from logbook.datarefs import LogbookDatarefs
 from logbook.flight_log import FlightLog
 from logbook.flight_phase import FlightPhase
+from logbook.flight_plan import FlightPlan
+from logbook.scheduler import CLOCK_SIM, PRIORITY_LOW, get_scheduler
 
 
 class PythonInterface:
@@ -31,20 +35,52 @@ class PythonInterface:
 
         self.output_file = output_dir.joinpath(output_file)
         self.flight_log = FlightLog()
-        self.flight_phase = FlightPhase(Aircraft)
+        self.flight_plan = FlightPlan(Aircraft)
+
+        # Airport/runway index built from the sim's apt.dat files, used to
+        # find the departure & arrival runways. It's only rebuilt when an
+        # apt.dat file has changed, in a separate Python process so the
+        # parse doesn't stall the sim.
+        self.airports = BackgroundIndex(
+            Path(xp.getSystemPath()), output_dir.joinpath('apt_index'),
+            python_executable=xp.pythonExecutable)
+
+        # Publish the flight phase, block/air time & landing counts as
+        # read-only custom datarefs for other plugins & cockpit displays.
+        self.datarefs = LogbookDatarefs()
+        self.datarefs.register()
 
         self.flight_log.aircraft_type = Aircraft.icao_type()
-        self.flight_log.origin = Aircraft.nearest_airport()
-        # TODO: try to get origin/dest from FMS
+        self.flight_phase = FlightPhase(
+            Aircraft, aircraft_type=self.flight_log.aircraft_type)
+        self.update_flight_plan()
 
-        # Register our FL callback with initial callback freq of 1 second
-        xp.registerFlightLoopCallback(self.FlightLoopCallback, 1.0, 0)
+        # Register our tasks with the shared scheduler, which runs them from
+        # its flight loop callback. Both run once per second; the flight plan
+        # lookup is deferred to a later frame when the frame budget is spent.
+        # Tracking runs on the sim clock, so it keeps pace with time
+        # compression and stops while the sim is paused.
+        self.scheduler = get_scheduler()
+        self.scheduler.add_task(
+            f"{self.Sig}.track", self.track_task, period=1.0, critical=True,
+            owner=self.Sig, clock=CLOCK_SIM, max_catch_up=1)
+        self.scheduler.add_task(
+            f"{self.Sig}.flight_plan", self.update_flight_plan, period=1.0,
+            priority=PRIORITY_LOW, owner=self.Sig)
 
         return self.Name, self.Sig, self.Desc
 
     def XPluginStop(self):
-        # Unregister the callback
-        xp.unregisterFlightLoopCallback(self.FlightLoopCallback, 0)
+        # Unregister our tasks & datarefs
+        self.scheduler.remove_owner(self.Sig)
+        self.datarefs.unregister()
+        self.airports.close()
+
+        self.flight_log.air_time = self.flight_log.calc_air_time()
+        self.flight_log.block_time = self.flight_log.calc_block_time()
+
+        if self.flight_log.destination is None:
+            self.flight_log.destination = Aircraft.nearest_airport().navAidID
 
         # Close the file
         #self.output_file.close()
@@ -60,11 +96,141 @@ class PythonInterface:
     def XPluginReceiveMessage(self, inFromWho, inMessage, inParam):
         pass
 
-    def FlightLoopCallback(self, elapsedMe, elapsedSim, counter, refcon):
+    def track_task(self, sample_times):
+        """
+        Scheduler task that updates the flight log with the aircraft's
+        current state. Runs once per second of sim time.
+
+        Parameters
+        ----------
+        sample_times : list of float
+            Sim flight times the task was due at. Only the current state is
+            needed, so missed updates aren't caught up.
+
+        Returns
+        -------
+        None.
+        """
         # TODO: Case for touch-n-go
+        time_local, time_zulu = self.get_time()
+
+        prev_phase = self.flight_phase.phase
+        self.flight_phase.update()
+        self.mark_phase_change(
+            prev_phase, self.flight_phase.phase, time_local, time_zulu)
+
+        lon, lat, alt_msl, _ = Aircraft.position()
+        self.flight_log.update_track(
+            lon, lat, alt_msl, Aircraft.speed_ground(),
+            airborne=not Aircraft.is_on_ground())
+
+        self.datarefs.update(self.flight_phase, self.flight_log, time_zulu)
+
+    def mark_phase_change(self, prev_phase, phase, time_local, time_zulu):
+        """
+        Record the out, off, on & in times and the landing count when the
+        flight phase changes.
+
+        Parameters
+        ----------
+        prev_phase : str
+            Flight phase before the latest update.
+        phase : str
+            Current flight phase.
+        time_local : int
+            Seconds since midnight, local time.
+        time_zulu : int
+            Seconds since midnight, zulu time.
+
+        Returns
+        -------
+        None.
+        """
+        if phase == prev_phase:
+            return
+
+        if prev_phase == FlightPhase.PHASE_RAMP:
+            self.flight_log.mark_time('out', time_local, time_zulu)
+        elif (prev_phase == FlightPhase.PHASE_TAXI_OUT and
+                phase == FlightPhase.PHASE_TAKEOFF):
+            # Not on TAXI_IN -> TAKEOFF: a touch-and-go doesn't change the
+            # departure airport.
+            self.mark_runway(departure=True)
+        elif (prev_phase == FlightPhase.PHASE_TAKEOFF and
+                phase == FlightPhase.PHASE_CLIMB):
+            self.flight_log.mark_time('off', time_local, time_zulu)
+        elif phase == FlightPhase.PHASE_TAXI_IN:
+            self.flight_log.mark_time('on', time_local, time_zulu)
+            self.mark_runway(departure=False)
+            self.flight_log.inc_landing_count(night=Aircraft.is_night())
+        elif (prev_phase == FlightPhase.PHASE_TAXI_IN and
+                phase == FlightPhase.PHASE_RAMP):
+            self.flight_log.mark_time('in', time_local, time_zulu)
+
+    def mark_runway(self, departure):
+        """
+        Record the runway the aircraft is on as the departure or arrival
+        runway. The runway's airport replaces the origin or destination
+        taken from the flight plan.
+
+        Parameters
+        ----------
+        departure : bool
+            True for the departure runway, False for the arrival runway.
+
+        Returns
+        -------
+        None.
+        """
+        index = self.airports.index
+        if index is None:
+            return
+
+        match = Aircraft.runway(index)
+        if match is None:
+            return
+
+        airport, runway = match
+        if departure:
+            self.flight_log.origin = airport
+            self.flight_log.departure_runway = runway
+        else:
+            self.flight_log.destination = airport
+            self.flight_log.arrival_runway = runway
+
+    def update_flight_plan(self):
+        """
+        Copy the origin, destination & planned distance of the FMS flight
+        plan to the flight log if the plan has changed.
+
+        Returns
+        -------
+        None.
+        """
+        if not self.flight_plan.refresh():
+            return
+
+        # Airports matched from the runways actually used take precedence
+        if self.flight_log.departure_runway is None:
+            self.flight_log.origin = self.flight_plan.origin
+        if self.flight_log.arrival_runway is None:
+            self.flight_log.destination = self.flight_plan.destination
+        self.flight_log.planned_distance = self.flight_plan.distance
+
+    def get_time(self):
+        """
+        Get the current local & zulu time from the source selected by
+        time_src.
+
+        Returns
+        -------
+        int, int
+            Local and zulu time
+        """
+        if self.time_src == "system":
+            return self.get_real_time()
 
-        # Return 1.0 to indicate that we want to be called again in 1 second.
-        return 1.0
+        return self.get_sim_time()
 
     def get_real_time(self):
         """
@@ -94,8 +260,8 @@ class PythonInterface:
         int, int
             Local and zulu time
         """
-        time_local = xp.getDatai("sim/time/local_time_sec")
-        time_zulu = xp.getDatai("sim/time/zulu_time_sec")
+        time_local = int(Aircraft.local_time())
+        time_zulu = int(Aircraft.zulu_time())
 
         return time_local, time_zulu
 
@@ -6,12 +6,22 @@ Simple aircraft track logger.
 M Nicholson
 21 NOV 2022
 """
+import multiprocessing
 from datetime import datetime, timedelta
-
-import XPLMProcessing
+from pathlib import Path
 
 from XPPython3 import xp
 
+from logbook.aircraft import Aircraft
+from logbook.broadcast import TelemetryBroadcaster
+from logbook.env_channels import EnvEncoder
+from logbook.flight_phase import FlightPhase
+from logbook.flight_recorder import FlightRecorder
+from logbook.scheduler import (
+    CLOCK_SIM, PRIORITY_HIGH, PRIORITY_LOW, get_scheduler)
+from logbook.shm_ring import TrackRingWriter
+from logbook.traffic import TrafficTracker
+
 
 class Util:
 
@@ -67,16 +77,102 @@ class PythonInterface:
         }
 
         self.enabled = True
-        self.timeStamp = datetime.now().strftime("%Y_%m_%d-%H%M")
+        self.outputDir = Path(__file__).parent.joinpath('tracklog')
+        self.timeStamp = self.parseTimeStamp()
         self.acftType = self.getAircraftType()
         self.trackFilename = self.parseTrackFilename()
 
-        # Set flight loop params & instantiate flight loop callback
+        # Set flight loop params. All work runs as tasks of the shared
+        # scheduler, which runs them from its flight loop callback. Sampling
+        # runs on the sim clock: trackRate is in seconds of sim time, so the
+        # track keeps the same point density under time compression, and
+        # nothing is sampled while the sim is paused.
         self.trackRate = 15  # Seconds
+        self.lastPosition = None
+        self.lastSampleTime = None
         self.loopSkip = -10  # Negative to indicate loops to skip
-
-        self.floop = self.floopCallback
-        XPLMProcessing.XPLMRegisterFlightLoopCallback(self.floop, -1, 0)
+        self.scheduler = get_scheduler()
+
+        # Environment channels. Set envEnabled to True to add wind, OAT & QNH
+        # to the track file. They're delta-encoded, so unchanged values cost
+        # almost nothing; decode them with logbook.env_channels.
+        self.envEnabled = False
+        self.envEncoder = EnvEncoder() if self.envEnabled else None
+
+        # Live telemetry broadcaster. Set broadcastEnabled to True to publish
+        # each sampled position & the current flight phase to the UDP targets
+        # below and to any WebSocket client on broadcastWsPort.
+        # Set broadcastWsPort to None to disable the WebSocket server.
+        self.broadcastEnabled = False
+        self.broadcastUdpTargets = [("127.0.0.1", 49100)]
+        self.broadcastWsHost = "127.0.0.1"
+        self.broadcastWsPort = 49101
+
+        self.flightPhase = FlightPhase(Aircraft, aircraft_type=self.acftType)
+        self.broadcaster = None
+        if self.broadcastEnabled:
+            self.broadcaster = TelemetryBroadcaster(
+                udp_targets=self.broadcastUdpTargets,
+                ws_host=self.broadcastWsHost,
+                ws_port=self.broadcastWsPort)
+            self.broadcaster.start()
+
+        # "Black box" recorder. Set blackBoxEnabled to True to record every
+        # aircraft dataref at frame rate into a ring buffer holding the last
+        # blackBoxFrames frames. A snapshot is written to outputDir only when
+        # one of the recorder triggers fires (hard landing, phase flapping).
+        self.blackBoxEnabled = False
+        self.blackBoxFrames = 3600
+        self.recorder = None
+        if self.blackBoxEnabled:
+            self.recorder = FlightRecorder(
+                Aircraft, self.outputDir, capacity=self.blackBoxFrames)
+            self.scheduler.add_task(
+                f"{self.Sig}.recorder", self.recorderTask, period=0,
+                priority=PRIORITY_HIGH, critical=True, owner=self.Sig,
+                clock=CLOCK_SIM)
+
+        # Multi-aircraft tracking. Set trafficEnabled to True to also record
+        # the position of every AI/multiplayer aircraft on each sample, to a
+        # single traffic track file in outputDir.
+        self.trafficEnabled = False
+        self.traffic = None
+        if self.trafficEnabled:
+            self.traffic = TrafficTracker(self.outputDir.joinpath(
+                f'TrafficTrackFile-{self.timeStamp}.csv'))
+            self.scheduler.add_task(
+                f"{self.Sig}.traffic", self.trafficTask,
+                period=self.trackRate, priority=PRIORITY_LOW, owner=self.Sig,
+                clock=CLOCK_SIM, max_catch_up=1)
+
+        # Shared-memory track ring. Set shmEnabled to True to publish a
+        # sample on every frame into the shared memory block shmName, holding
+        # the last shmCapacity samples. External processes on this machine
+        # can read it with logbook.shm_ring.TrackRingReader.
+        self.shmEnabled = False
+        self.shmName = "xp_tracklog"
+        self.shmCapacity = 65536
+        self.shmRing = None
+        if self.shmEnabled:
+            # Creating the block starts multiprocessing's resource tracker
+            # process. Inside the sim, sys.executable is X-Plane itself, so
+            # point multiprocessing at the embedded Python interpreter first.
+            multiprocessing.set_executable(xp.pythonExecutable)
+            self.shmRing = TrackRingWriter(self.shmName, self.shmCapacity)
+            # Resolved once; shmTask runs on every frame
+            self.shmRefs = tuple(
+                xp.findDataRef(Aircraft.DATAREFS[key]) for key in (
+                    "flight_time", "latitude", "longitude", "altitude_msl",
+                    "altitude_agl", "speed_ground", "speed_ias",
+                    "speed_vertical", "gear_fnrml"))
+            self.scheduler.add_task(
+                f"{self.Sig}.shm", self.shmTask, period=0,
+                priority=PRIORITY_HIGH, critical=True, owner=self.Sig,
+                clock=CLOCK_SIM)
+
+        self.scheduler.add_task(
+            f"{self.Sig}.track", self.trackTask, period=self.trackRate,
+            critical=True, owner=self.Sig, clock=CLOCK_SIM)
 
         #mySubMenuItem = xp.appendMenuItem(xp.findPluginsMenu(), "Python - Sim Data 1", 0)
         #self.myMenu = xp.createMenu("Sim Data", xp.findPluginsMenu(), mySubMenuItem, self.MyMenuHandlerCallback, 0)
@@ -87,8 +183,21 @@ class PythonInterface:
         return self.Name, self.Sig, self.Desc
 
     def XPluginStop(self):
+        self.scheduler.remove_owner(self.Sig)
+
+        if self.broadcaster is not None:
+            self.broadcaster.stop()
+
+        if self.traffic is not None:
+            self.traffic.close()
+
+        if self.recorder is not None:
+            self.recorder.stop()
+
+        if self.shmRing is not None:
+            self.shmRing.close()
+
         xp.destroyMenu(self.myMenu)
-        XPLMProcessing.XPLMUnregisterFlightLoopCallback(self.floop, 0)
 
     def XPluginEnable(self):
         return 1
@@ -99,42 +208,115 @@ class PythonInterface:
     def XPluginReceiveMessage(self, inFromWho, inMessage, inParam):
         pass
 
-    def floopCallback(self, elapsedMe, elapsedSim, counter, refcon):
+    def trackTask(self, sampleTimes):
         """
-        Flight loop callback method.
+        Scheduler task that samples & writes the aircraft position. Runs every
+        trackRate seconds of sim time.
+
+        If a frame spans several sample intervals, e.g. under heavy time
+        compression, the aircraft is sampled once and the missed records are
+        interpolated from the previous sample, then all of them are written
+        in one batch.
 
         Parameters
         ----------
-        elapsedMe : int?
-            Wall time since last callback.
-        elapsedSim : int?
-            Wall time since any flight loop was dispatched.
-        counter : int?
-            Monotonically increasing counter, bumped once per flight loop
-            dispatch from the sim.
-        refcon : idk
-            Ptr constant from callback registration.
+        sampleTimes : list of float
+            Sim flight times the track was due to be sampled at.
 
         Returns
         -------
-        int
-            Determines next call:
-                * 0 -> receiving callbacks
-                * Positive int -> how many seconds until next callback
-                * Negative int -> how many loops must pass until next callback.
+        None.
+        """
+        if not self.enabled:
+            return
+
+        simTime = Aircraft.flight_time()
+        currPosition = self.getPosition()
+
+        # Every record is stamped at its due time, so records stay exactly
+        # trackRate apart however long the frame was. The real sample is
+        # only the anchor the next records are interpolated from.
+        if self.lastPosition is not None and self.lastSampleTime < simTime:
+            records = [
+                self.interpolatePosition(
+                    self.lastPosition, currPosition,
+                    (t - self.lastSampleTime) /
+                    (simTime - self.lastSampleTime))
+                for t in sampleTimes
+                if self.lastSampleTime < t <= simTime]
+        else:
+            # First sample, or the sim time was reset
+            records = []
+        if not records:
+            records = [currPosition]
+
+        self.lastPosition = currPosition
+        self.lastSampleTime = simTime
+
+        if self.envEncoder is not None:
+            # Environment values are only read once per call; the earlier
+            # records leave the channels unchanged.
+            env = self.envEncoder.encode(Aircraft.environment())
+            records = [dict(record) for record in records]
+            for record in records[:-1]:
+                record.update(dict.fromkeys(env, ''))
+            records[-1].update(env)
+
+        self.writePositions(records)
+
+        if self.broadcaster is not None:
+            self.flightPhase.update()
+            self.broadcaster.publish(currPosition, self.flightPhase.phase)
+
+    def recorderTask(self, sampleTimes):
+        """
+        Scheduler task for the black box recorder. Records one frame into the
+        recorder ring buffer. Doesn't run while the sim is paused.
+
+        Returns
+        -------
+        None.
         """
         if self.enabled:
-            #fltTime = xp.getDatai(self.dataRefs.get("total_flight_time"))
-            #if fltTime % self.trackRate == 0:
-            # Dont need the above time check if we're returning the positive
-            # trackRate parameter
-            currPosition = self.getPosition()
-            self.writePosition(currPosition)
+            self.flightPhase.update()
+            self.recorder.record(self.flightPhase.phase)
 
-        return self.trackRate
+    def trafficTask(self, sampleTimes):
+        """
+        Scheduler task that records the position of AI/multiplayer aircraft.
+        Runs every trackRate seconds of sim time. Missed samples aren't
+        caught up, since other aircraft can't be interpolated reliably.
+
+        Returns
+        -------
+        None.
+        """
+        if self.enabled:
+            self.traffic.sample()
+
+    def shmTask(self, sampleTimes):
+        """
+        Scheduler task that publishes the current aircraft state into the
+        shared-memory track ring. Runs on every frame while the sim isn't
+        paused.
+
+        Returns
+        -------
+        None.
+        """
+        if self.enabled:
+            (timeRef, latRef, lonRef, mslRef, aglRef, gndSpdRef, iasRef,
+             vsRef, gearRef) = self.shmRefs
+            self.shmRing.write(
+                xp.getDataf(timeRef), xp.getDatad(latRef),
+                xp.getDatad(lonRef), xp.getDatad(mslRef),
+                xp.getDataf(aglRef), xp.getDataf(gndSpdRef),
+                xp.getDataf(iasRef), xp.getDataf(vsRef),
+                # Same test as Aircraft.is_on_ground()
+                xp.getDataf(gearRef) > 1)
 
     def getAircraftType(self):
-        return xp.getDatai(self.dataRefs.get("acft_type"))
+        return Aircraft.icao_type()
 
     def getSimTime(self):
         """
@@ -145,8 +327,8 @@ class PythonInterface:
         str
             Zulu time. Format: HH:MM:SS
         """
-        now = xp.getDatai(self.dataRefs.get("zulu_time"))
-        zuluTime = str(timedelta(now)).zfill(8)  # Add padding 0 if hr < 10
+        now = int(Aircraft.zulu_time())
+        zuluTime = str(timedelta(seconds=now)).zfill(8)  # Add padding 0 if hr < 10
 
         return zuluTime
 
@@ -165,15 +347,24 @@ class PythonInterface:
         * Ground speed: meters/sec
         * IAS: knots
         * Vertical speed: fpm
+        * Heading: degrees true
+        * Zulu time: seconds since midnight
+        * Day: zero-based day of the year
+        * On ground: 1 if the aircraft is on the ground, else 0
         """
+        lon, lat, alt_msl, _ = Aircraft.position()
         position = {
             "currTime": self.getSimTime(),
-            "currLat": xp.getDatai(self.dataRefs.get("latitude")),
-            "currLon": xp.getDatai(self.dataRefs.get("longitude")),
-            "currEle": xp.getDatai(self.dataRefs.get("elevation")),
-            "currGndSpeed": xp.getDatai(self.dataRefs.get("gnd_speed")),
-            "currAirSpeed": xp.getDatai(self.dataRefs.get("air_speed")),
-            "currVerSpeed": xp.getDatai(self.dataRefs.get("vert_speed")),
+            "currLat": lat,
+            "currLon": lon,
+            "currEle": alt_msl,
+            "currGndSpeed": Aircraft.speed_ground(),
+            "currAirSpeed": Aircraft.speed_ias(),
+            "currVerSpeed": Aircraft.speed_vertical(),
+            "currHdg": Aircraft.heading_true(),
+            "currZuluSec": Aircraft.zulu_time(),
+            "currDay": Aircraft.day_of_year(),
+            "currOnGround": int(Aircraft.is_on_ground()),
         }
         # Convert meter units to imperial
         footEle = Util.m_2_ft(position["currEle"])
@@ -182,6 +373,69 @@ class PythonInterface:
 
         return position
 
+    @staticmethod
+    def interpolatePosition(prevPosition, currPosition, frac):
+        """
+        Linearly interpolate between two positions returned by getPosition().
+
+        Parameters
+        ----------
+        prevPosition, currPosition : dict
+        frac : float
+            Fraction of the way from prevPosition to currPosition, in (0, 1].
+            Fields that can't be interpolated, e.g. on ground, are taken
+            from the nearer position.
+
+        Returns
+        -------
+        dict
+        """
+        position = dict(prevPosition if frac < 0.5 else currPosition)
+        for key in ("currLat", "currLon", "currEle", "currGndSpeed",
+                    "currAirSpeed", "currVerSpeed"):
+            position[key] = prevPosition[key] + frac * (
+                currPosition[key] - prevPosition[key])
+
+        # Heading wraps around at 360
+        dHdg = (currPosition["currHdg"] - prevPosition["currHdg"] + 180) % 360
+        position["currHdg"] = (
+            prevPosition["currHdg"] + frac * (dHdg - 180)) % 360
+
+        # Zulu time wraps around at midnight
+        dZulu = (currPosition["currZuluSec"] -
+                 prevPosition["currZuluSec"]) % 86400
+        zuluSec = prevPosition["currZuluSec"] + frac * dZulu
+        position["currDay"] = prevPosition["currDay"]
+        if zuluSec >= 86400:
+            zuluSec -= 86400
+            position["currDay"] = currPosition["currDay"]
+        position["currZuluSec"] = zuluSec
+        position["currTime"] = str(timedelta(seconds=int(zuluSec))).zfill(8)
+
+        return position
+
+    def parseTimeStamp(self):
+        """
+        Parse a timestamp for this session's output files. A counter is
+        appended if files with the same timestamp already exist in
+        outputDir, e.g. after a plugin reload, so a session never appends to
+        a previous session's files (the environment channels are delta
+        encoded relative to the start of the file).
+
+        Returns
+        -------
+        str
+        """
+        base = datetime.now().strftime("%Y_%m_%d-%H%M%S")
+        stamp = base
+        counter = 1
+        while (any(self.outputDir.glob(f'TrackLogFile-{stamp}-*')) or
+               any(self.outputDir.glob(f'TrafficTrackFile-{stamp}.*'))):
+            stamp = f'{base}-{counter}'
+            counter += 1
+
+        return stamp
+
     def parseTrackFilename(self):
         """
         Parse the name of the track log file to write.
@@ -206,4 +460,32 @@ class PythonInterface:
         -------
 
         """
+        self.writePositions([position])
+
+    def writePositions(self, positions):
+        """
+        Write a batch of positions to file, with a single open & write.
+
+        Parameters
+        ----------
+        positions : list of dict
+            Position information, oldest first. All must have the same keys.
+
+        Returns
+        -------
+        None.
+        """
+        trackFile = self.outputDir.joinpath(self.trackFilename)
+        lines = ''.join(
+            ','.join(str(x) for x in position.values()) + '\n'
+            for position in positions)
+
+        if trackFile.is_file():
+            with open(trackFile, 'a') as f_out:
+                f_out.write(lines)
+        else:
+            self.outputDir.mkdir(parents=True, exist_ok=True)
+            with open(trackFile, 'w') as f_out:
+                f_out.write(','.join(positions[0].keys()) + '\n')
+                f_out.write(lines)
 
@@ -11,25 +11,37 @@ Notes
 """
 from XPPython3 import xp
 
+from logbook import solar
+
 
 class Aircraft:
 
     DATAREFS = {
         "altitude_agl": "sim/flightmodel/position/y_agl",
         "altitude_msl": "sim/flightmodel/position/elevation",
+        "day_of_year": "sim/time/local_date_days",
         "eng_num": "sim/aircraft/engine/acf_num_engines",
         "eng_throttle": "sim/flightmodel/engine/ENGN_thro",
         "eng_running": "sim/flightmodel/engine/ENGN_running",
+        "flight_time": "sim/time/total_flight_time_sec",
         "gear_fnrml": "sim/flightmodel/forces/fnrml_gear",
+        "heading_true": "sim/flightmodel/position/psi",
         "icao_type": "sim/aircraft/view/acf_ICAO",
         "latitude": "sim/flightmodel/position/latitude",
+        "local_time": "sim/time/local_time_sec",
         "longitude": "sim/flightmodel/position/longitude",
+        "magnetic_variation": "sim/flightmodel/position/magnetic_variation",
+        "oat": "sim/cockpit2/temperature/outside_air_temp_degc",
         "parking_brake": "sim/flightmodel/controls/parkbrake",
+        "qnh": "sim/weather/barometer_sealevel_inhg",
         "speed_ground": "sim/flightmodel/position/groundspeed",
         "speed_ias": "sim/flightmodel/position/indicated_airspeed",
         "speed_vertical": "sim/flightmodel/position/vh_ind_fpm",
         "sun_pitch": "sim/graphics/scenery/sun_pitch_degrees",
         "wheels_on_ground": "sim/flightmodel/failures/onground_any",
+        "wind_direction": "sim/cockpit2/gauges/indicators/wind_heading_deg_mag",
+        "wind_speed": "sim/cockpit2/gauges/indicators/wind_speed_kts",
+        "zulu_time": "sim/time/zulu_time_sec",
     }
 
     @classmethod
@@ -58,11 +70,78 @@ class Aircraft:
         """
         return xp.getDataf(cls.get_dataref("altitude_msl"))
 
+    @classmethod
+    def day_of_year(cls):
+        """
+        Sim date, as the zero-based day of the year.
+
+        Dataref type: int
+
+        Returns
+        -------
+        int
+        """
+        return xp.getDatai(cls.get_dataref("day_of_year"))
+
+    @classmethod
+    def environment(cls):
+        """
+        Weather at the aircraft's position.
+
+        Dataref types:
+            * wind_direction: float
+            * magnetic_variation: float
+            * wind_speed: float
+            * oat: float
+            * qnh: float
+
+        Returns
+        -------
+        tuple
+            * wind direction, in degrees true
+            * wind speed, in knots
+            * outside air temperature, in degrees C
+            * sea level pressure (QNH), in inches of mercury
+        """
+        wind_mag = xp.getDataf(cls.get_dataref("wind_direction"))
+        variation = xp.getDataf(cls.get_dataref("magnetic_variation"))
+        wind_speed = xp.getDataf(cls.get_dataref("wind_speed"))
+        oat = xp.getDataf(cls.get_dataref("oat"))
+        qnh = xp.getDataf(cls.get_dataref("qnh"))
+
+        return (wind_mag + variation) % 360, wind_speed, oat, qnh
+
+    @classmethod
+    def flight_time(cls):
+        """
+        Total sim time since the flight was started, in seconds.
+
+        Dataref type: float
+
+        Returns
+        -------
+        float
+        """
+        return xp.getDataf(cls.get_dataref("flight_time"))
+
     @classmethod
     def get_dataref(cls, data_str):
         d_ref = cls.DATAREFS.get(data_str)
         return xp.findDataRef(d_ref)
 
+    @classmethod
+    def heading_true(cls):
+        """
+        Aircraft's true heading, in degrees.
+
+        Dataref type: float
+
+        Returns
+        -------
+        float
+        """
+        return xp.getDataf(cls.get_dataref("heading_true"))
+
     @classmethod
     def icao_type(cls):
         """
@@ -91,7 +170,8 @@ class Aircraft:
         """
         is_running = False
         n_engines = xp.getDatai(cls.get_dataref("eng_num"))
-        running = xp.getDatai(cls.get_dataref("eng_running"), n_engines)
+        running = []
+        xp.getDatavi(cls.get_dataref("eng_running"), running, 0, n_engines)
 
         if 1 in running:
             is_running = True
@@ -100,7 +180,18 @@ class Aircraft:
 
     @classmethod
     def is_night(cls):
-        return xp.getDataf(cls.dataRefs.get("sunPitch")) <= 6.0
+        """
+        Is it night at the aircraft's position? Computed from the sim date &
+        zulu time, see logbook.solar.
+
+        Returns
+        -------
+        bool
+        """
+        lon, lat, _, _ = cls.position()
+        night = solar.is_night(lat, lon, cls.day_of_year(), cls.zulu_time())
+
+        return bool(night)
 
     @classmethod
     def is_on_ground(cls):
@@ -143,6 +234,19 @@ class Aircraft:
         """
         return xp.getDataf(cls.get_dataref("speed_ground")) < 1
 
+    @classmethod
+    def local_time(cls):
+        """
+        Sim local time, in seconds since midnight.
+
+        Dataref type: float
+
+        Returns
+        -------
+        float
+        """
+        return xp.getDataf(cls.get_dataref("local_time"))
+
     @classmethod
     def nearest_airport(cls):
         """
@@ -203,6 +307,24 @@ class Aircraft:
 
         return lon, lat, alt_msl, alt_agl
 
+    @classmethod
+    def runway(cls, airport_index):
+        """
+        Match the aircraft's position & heading to a runway.
+
+        Parameters
+        ----------
+        airport_index : logbook.airports.AirportIndex
+
+        Returns
+        -------
+        tuple or None
+            Airport ICAO code & runway ident, or None if the aircraft isn't
+            on or near a runway.
+        """
+        lon, lat, _, _ = cls.position()
+        return airport_index.match_runway(lat, lon, cls.heading_true())
+
     @classmethod
     def speed_ground(cls):
         """
@@ -261,3 +383,16 @@ class Aircraft:
         throttle_avg = sum(throttle_ratio) / len(throttle_ratio)
 
         return throttle_avg
+
+    @classmethod
+    def zulu_time(cls):
+        """
+        Sim zulu time, in seconds since midnight.
+
+        Dataref type: float
+
+        Returns
+        -------
+        float
+        """
+        return xp.getDataf(cls.get_dataref("zulu_time"))
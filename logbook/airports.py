@@ -0,0 +1,492 @@
+"""
+airports.py
+
+Streaming apt.dat parser & memory-mapped airport/runway index, used to
+match takeoff & touchdown positions to a runway.
+
+Notes
+-----
+* apt.dat files are read line by line; only airport headers (row codes 1,
+  16 & 17) and land runways (row code 100) are parsed.
+* The index is a set of .npy files opened with mmap_mode='r', so opening it
+  costs almost nothing and only the pages a lookup touches are read.
+* A manifest records the size & modification time of every source file.
+  The index is only rebuilt when a source file is added, removed or
+  changed.
+* Runway ends are sorted by 1x1 degree cell, so a lookup only considers the
+  runways in the 3x3 cells around the aircraft.
+* Sources are given in priority order: the first file defining an airport
+  wins, like X-Plane's scenery pack order.
+* Building the index parses hundreds of MB of apt.dat, so it's meant to run
+  offline, in its own process (see Usage). Inside the sim, BackgroundIndex
+  only opens an index that is already current, and launches the build as a
+  separate process when it isn't, so the parse never competes with the
+  flight loop for the GIL.
+
+Usage
+-----
+python -m logbook.airports <X-Plane folder> <index folder>
+"""
+import json
+import math
+import os
+from pathlib import Path
+import subprocess
+import sys
+
+import numpy as np
+
+INDEX_VERSION = 1
+EARTH_RADIUS_M = 6371008.8
+
+AIRPORT_DTYPE = np.dtype([
+    ('icao', 'S8'),
+    ('lat', '<f8'),
+    ('lon', '<f8'),
+    ('elevation', '<f4'),  # feet
+    ('rwy_start', '<u4'),
+    ('rwy_count', '<u2'),
+])
+
+RUNWAY_DTYPE = np.dtype([
+    ('airport', '<u4'),
+    ('ident', 'S4'),
+    ('lat', '<f8'),
+    ('lon', '<f8'),
+    ('heading', '<f4'),  # degrees true, from this end towards the other
+    ('length', '<f4'),   # meters
+])
+
+
+def find_apt_dat(xplane_root):
+    """
+    Find the apt.dat files of an X-Plane installation, in priority order.
+
+    Parameters
+    ----------
+    xplane_root : pathlib.Path
+        X-Plane installation folder.
+
+    Returns
+    -------
+    list of pathlib.Path
+    """
+    xplane_root = Path(xplane_root)
+    custom = xplane_root.joinpath('Custom Scenery')
+
+    packs = []
+    packs_ini = custom.joinpath('scenery_packs.ini')
+    if packs_ini.is_file():
+        with open(packs_ini, encoding='utf-8', errors='replace') as f_in:
+            for line in f_in:
+                if line.startswith('SCENERY_PACK '):
+                    packs.append(xplane_root.joinpath(
+                        line[len('SCENERY_PACK '):].strip()))
+    elif custom.is_dir():
+        packs = sorted(p for p in custom.iterdir() if p.is_dir())
+
+    packs.extend([
+        # X-Plane 12
+        xplane_root.joinpath('Global Scenery', 'Global Airports'),
+        # X-Plane 11
+        xplane_root.joinpath(
+            'Resources', 'default scenery', 'default apt dat'),
+    ])
+
+    sources = []
+    for pack in packs:
+        apt_dat = pack.joinpath('Earth nav data', 'apt.dat')
+        if apt_dat.is_file() and apt_dat not in sources:
+            sources.append(apt_dat)
+
+    return sources
+
+
+def parse_apt_dat(apt_dat):
+    """
+    Stream the airports & land runways out of an apt.dat file.
+
+    Parameters
+    ----------
+    apt_dat : pathlib.Path
+
+    Yields
+    ------
+    str, float, list
+        Airport ICAO code, elevation in feet, and a list of runways as
+        (ident1, lat1, lon1, ident2, lat2, lon2) tuples.
+    """
+    icao = None
+    elevation = 0.0
+    runways = []
+
+    with open(apt_dat, 'rb') as f_in:
+        for line in f_in:
+            if line.startswith(b'100 '):
+                if icao is None:
+                    continue
+                fields = line.split()
+                try:
+                    runways.append((
+                        fields[8].decode('ascii', 'replace'),
+                        float(fields[9]), float(fields[10]),
+                        fields[17].decode('ascii', 'replace'),
+                        float(fields[18]), float(fields[19])))
+                except (IndexError, ValueError):
+                    pass
+
+            elif line.startswith((b'1 ', b'16 ', b'17 ', b'99')):
+                if icao is not None and runways:
+                    yield icao, elevation, runways
+
+                icao = None
+                runways = []
+                fields = line.split()
+                if fields[0] in (b'1', b'16', b'17') and len(fields) >= 5:
+                    icao = fields[4].decode('ascii', 'replace')
+                    try:
+                        elevation = float(fields[1])
+                    except ValueError:
+                        elevation = 0.0
+
+    if icao is not None and runways:
+        yield icao, elevation, runways
+
+
+def _bearing(lat1, lon1, lat2, lon2):
+    """Initial great-circle bearing from point 1 to point 2, in degrees."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_lambda = math.radians(lon2 - lon1)
+    y = math.sin(d_lambda) * math.cos(phi2)
+    x = (math.cos(phi1) * math.sin(phi2) -
+         math.sin(phi1) * math.cos(phi2) * math.cos(d_lambda))
+
+    return math.degrees(math.atan2(y, x)) % 360
+
+
+def _distance(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points, in meters."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2 +
+         math.cos(phi1) * math.cos(phi2) *
+         math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _cell(lat, lon):
+    return ((np.floor(lat).astype(np.int32) + 90) * 360 +
+            np.floor(lon).astype(np.int32) + 180)
+
+
+def _source_manifest(sources):
+    manifest = []
+    for source in sources:
+        stat = os.stat(source)
+        manifest.append([str(source), stat.st_size, stat.st_mtime_ns])
+
+    return {'version': INDEX_VERSION, 'sources': manifest}
+
+
+def build_index(sources, index_dir):
+    """
+    Parse apt.dat files into an airport/runway index.
+
+    Parameters
+    ----------
+    sources : list of pathlib.Path
+        apt.dat files, in priority order.
+    index_dir : pathlib.Path
+        Folder to write the index to.
+
+    Returns
+    -------
+    None.
+    """
+    airports = []
+    runways = []
+    seen = set()
+
+    for source in sources:
+        for icao, elevation, airport_rwys in parse_apt_dat(source):
+            if icao in seen:
+                continue
+            seen.add(icao)
+
+            airport = len(airports)
+            rwy_start = len(runways)
+            for ident1, lat1, lon1, ident2, lat2, lon2 in airport_rwys:
+                length = _distance(lat1, lon1, lat2, lon2)
+                runways.append((
+                    airport, ident1, lat1, lon1,
+                    _bearing(lat1, lon1, lat2, lon2), length))
+                runways.append((
+                    airport, ident2, lat2, lon2,
+                    _bearing(lat2, lon2, lat1, lon1), length))
+
+            ends = runways[rwy_start:]
+            airports.append((
+                icao,
+                sum(r[2] for r in ends) / len(ends),
+                sum(r[3] for r in ends) / len(ends),
+                elevation, rwy_start, len(ends)))
+
+    airports = np.array(airports, dtype=AIRPORT_DTYPE)
+    runways = np.array(runways, dtype=RUNWAY_DTYPE)
+
+    cells = _cell(runways['lat'], runways['lon'])
+    cell_order = np.argsort(cells, kind='stable').astype(np.uint32)
+
+    index_dir = Path(index_dir)
+    index_dir.mkdir(parents=True, exist_ok=True)
+    arrays = {
+        'airports': airports,
+        'runways': runways,
+        'cell_order': cell_order,
+        'cell_keys': cells[cell_order],
+    }
+    for name, array in arrays.items():
+        tmp_file = index_dir.joinpath(f'{name}.tmp.npy')
+        np.save(tmp_file, array)
+        os.replace(tmp_file, index_dir.joinpath(f'{name}.npy'))
+
+    # Written last, so an interrupted build is never mistaken for current.
+    with open(index_dir.joinpath('manifest.json'), 'w') as f_out:
+        json.dump(_source_manifest(sources), f_out)
+
+
+def is_current(sources, index_dir):
+    """
+    Check whether an index is up to date with its source files.
+
+    Parameters
+    ----------
+    sources : list of pathlib.Path
+    index_dir : pathlib.Path
+
+    Returns
+    -------
+    bool
+    """
+    try:
+        with open(Path(index_dir).joinpath('manifest.json')) as f_in:
+            manifest = json.load(f_in)
+    except (OSError, ValueError):
+        return False
+
+    try:
+        return manifest == _source_manifest(sources)
+    except OSError:
+        return False
+
+
+class AirportIndex:
+    """
+    Memory-mapped airport/runway index.
+
+    Parameters
+    ----------
+    index_dir : pathlib.Path
+        Folder holding an index written by build_index().
+    """
+
+    def __init__(self, index_dir):
+        index_dir = Path(index_dir)
+        self._airports = np.load(
+            index_dir.joinpath('airports.npy'), mmap_mode='r')
+        self._runways = np.load(
+            index_dir.joinpath('runways.npy'), mmap_mode='r')
+        self._cell_order = np.load(
+            index_dir.joinpath('cell_order.npy'), mmap_mode='r')
+        self._cell_keys = np.load(
+            index_dir.joinpath('cell_keys.npy'), mmap_mode='r')
+
+    @classmethod
+    def open(cls, sources, index_dir):
+        """
+        Open an index, rebuilding it first if its sources have changed.
+
+        Parameters
+        ----------
+        sources : list of pathlib.Path
+            apt.dat files, in priority order.
+        index_dir : pathlib.Path
+
+        Returns
+        -------
+        AirportIndex
+        """
+        if not is_current(sources, index_dir):
+            build_index(sources, index_dir)
+
+        return cls(index_dir)
+
+    def airport(self, icao):
+        """
+        Look up an airport by ICAO code.
+
+        Parameters
+        ----------
+        icao : str
+
+        Returns
+        -------
+        numpy.void or None
+            Airport record, see AIRPORT_DTYPE.
+        """
+        matches = np.flatnonzero(self._airports['icao'] == icao.encode())
+        if not matches.size:
+            return None
+
+        return self._airports[matches[0]]
+
+    def match_runway(self, lat, lon, heading, max_heading_diff=30.0,
+                     max_offset=150.0, max_overrun=1000.0):
+        """
+        Find the runway an aircraft is on, or is taking off from or landing
+        on.
+
+        Parameters
+        ----------
+        lat, lon : float
+            Aircraft position, in decimal degrees.
+        heading : float
+            Aircraft true heading, in degrees.
+        max_heading_diff : float, optional
+            Largest difference between the aircraft & runway headings, in
+            degrees. Default is 30.
+        max_offset : float, optional
+            Largest distance from the runway centerline, in meters. Default
+            is 150.
+        max_overrun : float, optional
+            How far before the threshold or past the end of the runway the
+            aircraft may be, in meters. Default is 1000.
+
+        Returns
+        -------
+        tuple or None
+            Airport ICAO code & runway ident, or None if no runway matches.
+        """
+        lat_cell = int(math.floor(lat)) + 90
+        lon_cell = int(math.floor(lon)) + 180
+
+        candidates = []
+        for d_lat in (-1, 0, 1):
+            for d_lon in (-1, 0, 1):
+                key = (lat_cell + d_lat) * 360 + (lon_cell + d_lon) % 360
+                lo, hi = np.searchsorted(self._cell_keys, [key, key + 1])
+                if hi > lo:
+                    candidates.append(self._cell_order[lo:hi])
+
+        if not candidates:
+            return None
+
+        idx = np.concatenate(candidates)
+        rwys = self._runways[idx]
+
+        # Aircraft position relative to each runway threshold, in meters, on
+        # a plane tangent to the Earth at the aircraft.
+        north = np.radians(lat - rwys['lat']) * EARTH_RADIUS_M
+        east = (np.radians(lon - rwys['lon']) * EARTH_RADIUS_M *
+                math.cos(math.radians(lat)))
+
+        rwy_hdg = np.radians(rwys['heading'])
+        along = north * np.cos(rwy_hdg) + east * np.sin(rwy_hdg)
+        offset = np.abs(east * np.cos(rwy_hdg) - north * np.sin(rwy_hdg))
+        hdg_diff = np.abs((heading - rwys['heading'] + 180) % 360 - 180)
+
+        ok = ((hdg_diff <= max_heading_diff) &
+              (offset <= max_offset) &
+              (along >= -max_overrun) &
+              (along <= rwys['length'] + max_overrun))
+        if not ok.any():
+            return None
+
+        score = np.where(ok, offset + hdg_diff * 10, np.inf)
+        best = rwys[int(np.argmin(score))]
+        icao = self._airports[best['airport']]['icao']
+
+        return icao.decode(), best['ident'].decode()
+
+
+class BackgroundIndex:
+    """
+    Open the AirportIndex of an X-Plane installation if it's current, or
+    rebuild it in a separate Python process & open it once that finishes.
+    Nothing is parsed in the calling process.
+
+    Parameters
+    ----------
+    xplane_root : pathlib.Path
+        X-Plane installation folder.
+    index_dir : pathlib.Path
+    python_executable : str, optional
+        Python interpreter to run the rebuild with. Inside XPPython3 this
+        must be xp.pythonExecutable; sys.executable is the sim itself. If
+        None, a stale index isn't rebuilt and the command to rebuild it is
+        printed instead.
+    """
+
+    def __init__(self, xplane_root, index_dir, python_executable=None):
+        self._index = None
+        self._index_dir = Path(index_dir)
+        self._sources = find_apt_dat(xplane_root)
+        self._build = None
+
+        if not self._sources:
+            return
+
+        if is_current(self._sources, self._index_dir):
+            self._index = AirportIndex(self._index_dir)
+            return
+
+        args = ['-m', 'logbook.airports', str(xplane_root),
+                str(self._index_dir)]
+        if python_executable is None:
+            print('Airport index is out of date; rebuild it with: '
+                  f'python -m logbook.airports "{xplane_root}" '
+                  f'"{self._index_dir}"')
+            return
+
+        self._build = subprocess.Popen(
+            [python_executable] + args,
+            cwd=Path(__file__).resolve().parent.parent,
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+
+    @property
+    def index(self):
+        """The AirportIndex, or None while it's unavailable or rebuilding."""
+        if self._build is not None and self._build.poll() is not None:
+            build, self._build = self._build, None
+            if build.returncode == 0 and is_current(
+                    self._sources, self._index_dir):
+                self._index = AirportIndex(self._index_dir)
+            else:
+                print(f'Airport index rebuild failed ({build.returncode})')
+
+        return self._index
+
+    def close(self):
+        """
+        Stop a rebuild that is still running.
+
+        Returns
+        -------
+        None.
+        """
+        if self._build is not None and self._build.poll() is None:
+            self._build.terminate()
+        self._build = None
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit('Usage: python -m logbook.airports '
+                 '<X-Plane folder> <index folder>')
+
+    apt_sources = find_apt_dat(sys.argv[1])
+    if is_current(apt_sources, sys.argv[2]):
+        print('Index is up to date')
+    else:
+        build_index(apt_sources, sys.argv[2])
+        print(f'Indexed {len(apt_sources)} apt.dat files')
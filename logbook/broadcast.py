@@ -0,0 +1,354 @@
+"""
+broadcast.py
+
+Live telemetry broadcaster. Publishes aircraft samples over UDP and/or
+WebSocket from a dedicated asyncio thread so the flight loop never touches
+a socket.
+
+Notes
+-----
+* The flight loop hands samples over by swapping a single reference and
+  scheduling a wake-up on the event loop; it never waits on a lock or a
+  socket.
+* Each endpoint is opened independently; if one fails (e.g. the WebSocket
+  port is already in use) the failure is logged and the others still run.
+* Each sample is encoded once and the same bytes are fanned out to every
+  client. A client that is still draining a previous frame only ever sees
+  the most recent one, so slow clients are coalesced instead of queued.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import socket
+import struct
+import threading
+import traceback
+
+
+class _WebSocketClient:
+    """
+    State for a single connected WebSocket client.
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.frame = None
+        self.ready = asyncio.Event()
+
+
+class TelemetryBroadcaster:
+    """
+    Broadcast telemetry samples to UDP targets and WebSocket clients.
+
+    Parameters
+    ----------
+    udp_targets : list of (str, int), optional
+        Host/port pairs to send each sample to as a UDP datagram. Use a
+        LAN broadcast address (e.g. 192.168.1.255) to reach the whole LAN.
+    ws_host : str, optional
+        Interface the WebSocket server listens on. Default is localhost.
+    ws_port : int, optional
+        Port the WebSocket server listens on. None disables the server.
+    """
+
+    WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+    def __init__(self, udp_targets=None, ws_host='127.0.0.1', ws_port=None):
+        self._udp_targets = list(udp_targets or [])
+        self._ws_host = ws_host
+        self._ws_port = ws_port
+
+        self._latest = None
+        self._seq = 0
+        self._wake_pending = False
+
+        self._loop = None
+        self._thread = None
+        self._udp_transport = None
+        self._ws_server = None
+        self._ws_clients = set()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """
+        Start the broadcaster thread.
+
+        Returns
+        -------
+        None.
+        """
+        if self.running:
+            return
+
+        started = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, args=(started,), name='TelemetryBroadcaster',
+            daemon=True)
+        self._thread.start()
+        started.wait(timeout=5.0)
+
+    def stop(self):
+        """
+        Stop the broadcaster thread and close all sockets.
+
+        Returns
+        -------
+        None.
+        """
+        if not self.running:
+            return
+
+        self._loop.call_soon_threadsafe(self._shutdown)
+        self._thread.join(timeout=5.0)
+        self._thread = None
+
+    def publish(self, sample, phase=None):
+        """
+        Hand a sample over to the broadcaster thread. Safe to call from the
+        flight loop; never blocks.
+
+        Parameters
+        ----------
+        sample : dict
+            Position information.
+        phase : str, optional
+            Current flight phase.
+
+        Returns
+        -------
+        None.
+        """
+        loop = self._loop
+        if loop is None:
+            return
+
+        self._seq += 1
+        # Single reference assignment; the broadcaster thread only ever reads
+        # the latest sample, so older ones are dropped here for free.
+        self._latest = (self._seq, sample, phase)
+
+        if not self._wake_pending:
+            self._wake_pending = True
+            try:
+                loop.call_soon_threadsafe(self._broadcast)
+            except RuntimeError:
+                # Event loop already closed.
+                pass
+
+    def _run(self, started):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._loop = loop
+        try:
+            opened = loop.run_until_complete(self._open())
+        except BaseException:
+            opened = False
+            traceback.print_exc()
+
+        if not opened:
+            # Nothing to serve; don't leave publish() queueing callbacks on a
+            # loop that will never run.
+            self._loop = None
+            loop.run_until_complete(self._close())
+            loop.close()
+            started.set()
+            return
+
+        started.set()
+        try:
+            loop.run_forever()
+        finally:
+            self._loop = None
+            loop.run_until_complete(self._close())
+            loop.close()
+
+    async def _open(self):
+        """
+        Open the UDP & WebSocket endpoints.
+
+        Returns
+        -------
+        bool
+            True if at least one endpoint is open.
+        """
+        if self._udp_targets:
+            try:
+                self._udp_transport, _ = (
+                    await self._loop.create_datagram_endpoint(
+                        asyncio.DatagramProtocol, family=socket.AF_INET,
+                        allow_broadcast=True))
+            except OSError as err:
+                print(f'TelemetryBroadcaster: UDP disabled: {err}')
+
+        if self._ws_port is not None:
+            try:
+                self._ws_server = await asyncio.start_server(
+                    self._serve_ws_client, self._ws_host, self._ws_port)
+            except OSError as err:
+                print(f'TelemetryBroadcaster: WebSocket server on '
+                      f'{self._ws_host}:{self._ws_port} disabled: {err}')
+
+        return self._udp_transport is not None or self._ws_server is not None
+
+    async def _close(self):
+        if self._udp_transport is not None:
+            self._udp_transport.close()
+            self._udp_transport = None
+
+        if self._ws_server is not None:
+            self._ws_server.close()
+            await self._ws_server.wait_closed()
+            self._ws_server = None
+
+        for client in list(self._ws_clients):
+            client.writer.close()
+        self._ws_clients.clear()
+
+        tasks = [t for t in asyncio.all_tasks(self._loop)
+                 if t is not asyncio.current_task(self._loop)]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _shutdown(self):
+        self._loop.stop()
+
+    def _broadcast(self):
+        self._wake_pending = False
+        latest = self._latest
+        if latest is None:
+            return
+
+        seq, sample, phase = latest
+        payload = json.dumps(
+            {'seq': seq, 'phase': phase, **sample},
+            separators=(',', ':')).encode('utf-8')
+
+        if self._udp_transport is not None:
+            for target in self._udp_targets:
+                try:
+                    self._udp_transport.sendto(payload, target)
+                except OSError:
+                    pass
+
+        if self._ws_clients:
+            frame = self.ws_frame(payload)
+            for client in self._ws_clients:
+                client.frame = frame
+                client.ready.set()
+
+    async def _serve_ws_client(self, reader, writer):
+        try:
+            if not await self._ws_handshake(reader, writer):
+                writer.close()
+                return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            writer.close()
+            return
+
+        client = _WebSocketClient(writer)
+        self._ws_clients.add(client)
+        drain = asyncio.ensure_future(self._drain_ws_input(reader))
+        ready = None
+        try:
+            while True:
+                # Wait for the next frame or the client going away, whichever
+                # comes first, so a disconnect is noticed even while no
+                # samples are being published (e.g. sim paused).
+                ready = asyncio.ensure_future(client.ready.wait())
+                await asyncio.wait(
+                    {drain, ready}, return_when=asyncio.FIRST_COMPLETED)
+                if drain.done():
+                    break
+
+                client.ready.clear()
+                writer.write(client.frame)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._ws_clients.discard(client)
+            drain.cancel()
+            if ready is not None:
+                ready.cancel()
+            writer.close()
+
+    async def _ws_handshake(self, reader, writer):
+        request = await reader.readuntil(b'\r\n\r\n')
+        key = None
+        for line in request.decode('latin-1').split('\r\n')[1:]:
+            name, _, value = line.partition(':')
+            if name.strip().lower() == 'sec-websocket-key':
+                key = value.strip()
+
+        if key is None:
+            writer.write(b'HTTP/1.1 400 Bad Request\r\n\r\n')
+            return False
+
+        accept = base64.b64encode(
+            hashlib.sha1((key + self.WS_GUID).encode('ascii')).digest())
+        writer.write(
+            b'HTTP/1.1 101 Switching Protocols\r\n'
+            b'Upgrade: websocket\r\n'
+            b'Connection: Upgrade\r\n'
+            b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+        await writer.drain()
+
+        return True
+
+    @staticmethod
+    async def _drain_ws_input(reader):
+        """
+        Discard anything the client sends, frame by frame. Returns once the
+        client closes the connection or sends a close frame.
+        """
+        try:
+            while True:
+                head = await reader.readexactly(2)
+                opcode = head[0] & 0x0F
+                length = head[1] & 0x7F
+                if length == 126:
+                    length, = struct.unpack('!H', await reader.readexactly(2))
+                elif length == 127:
+                    length, = struct.unpack('!Q', await reader.readexactly(8))
+                if head[1] & 0x80:
+                    # Masking key
+                    length += 4
+
+                if opcode == 0x8:
+                    return
+
+                while length:
+                    chunk = await reader.read(min(length, 65536))
+                    if not chunk:
+                        return
+                    length -= len(chunk)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            return
+
+    @staticmethod
+    def ws_frame(payload):
+        """
+        Wrap a payload in a single unmasked WebSocket text frame.
+
+        Parameters
+        ----------
+        payload : bytes
+
+        Returns
+        -------
+        bytes
+        """
+        length = len(payload)
+        if length < 126:
+            header = struct.pack('!BB', 0x81, length)
+        elif length < 65536:
+            header = struct.pack('!BBH', 0x81, 126, length)
+        else:
+            header = struct.pack('!BBQ', 0x81, 127, length)
+
+        return header + payload
@@ -0,0 +1,122 @@
+"""
+datarefs.py
+
+Read-only custom datarefs publishing the logbook's computed state, so other
+plugins & cockpit displays don't have to recompute it.
+
+Notes
+-----
+* Values are cached once per tick by update(); the accessor callbacks only
+  return the cached value.
+* Published datarefs (prefix xppython3/logbook/):
+    * phase : int, index of the current phase in FlightPhase.PHASES
+    * phase_name : byte[], name of the current phase
+    * block_time : float, block time so far, in hours
+    * air_time : float, air time so far, in hours
+    * landings : int, number of landings
+    * night_landings : int, number of night landings
+"""
+from XPPython3 import xp
+
+
+class LogbookDatarefs:
+    """
+    Custom datarefs backed by live FlightPhase & FlightLog state.
+    """
+    PREFIX = "xppython3/logbook/"
+
+    DRE_SIGNATURE = "xplanesdk.examples.DataRefEditor"
+    DRE_MSG_ADD_DATAREF = 0x01000000
+
+    def __init__(self):
+        self._values = {
+            "phase": 0,
+            "phase_name": b"",
+            "block_time": 0.0,
+            "air_time": 0.0,
+            "landings": 0,
+            "night_landings": 0,
+        }
+        self._refs = []
+
+    def register(self):
+        """
+        Register the custom datarefs with the sim.
+
+        Returns
+        -------
+        None.
+        """
+        if self._refs:
+            return
+
+        for name, value in self._values.items():
+            if isinstance(value, bytes):
+                ref = xp.registerDataAccessor(
+                    self.PREFIX + name, xp.Type_Data, 0,
+                    readData=self._read_data, readRefCon=name)
+            elif isinstance(value, float):
+                ref = xp.registerDataAccessor(
+                    self.PREFIX + name, xp.Type_Float, 0,
+                    readFloat=self._read_value, readRefCon=name)
+            else:
+                ref = xp.registerDataAccessor(
+                    self.PREFIX + name, xp.Type_Int, 0,
+                    readInt=self._read_value, readRefCon=name)
+            self._refs.append(ref)
+
+        # Let DataRefEditor know about our datarefs, if it's installed.
+        dre = xp.findPluginBySignature(self.DRE_SIGNATURE)
+        if dre != xp.NO_PLUGIN_ID:
+            for name in self._values:
+                xp.sendMessageToPlugin(
+                    dre, self.DRE_MSG_ADD_DATAREF, self.PREFIX + name)
+
+    def unregister(self):
+        """
+        Unregister the custom datarefs.
+
+        Returns
+        -------
+        None.
+        """
+        for ref in self._refs:
+            xp.unregisterDataAccessor(ref)
+        self._refs = []
+
+    def update(self, flight_phase, flight_log, now_zulu):
+        """
+        Cache the current logbook state. Call once per tick.
+
+        Parameters
+        ----------
+        flight_phase : FlightPhase
+        flight_log : FlightLog
+        now_zulu : int
+            Current zulu time, in seconds since midnight.
+
+        Returns
+        -------
+        None.
+        """
+        phase = flight_phase.phase
+        values = self._values
+        values["phase"] = flight_phase.PHASES.index(phase)
+        values["phase_name"] = phase.encode("ascii")
+        values["block_time"] = flight_log.calc_block_time(now_zulu) or 0.0
+        values["air_time"] = flight_log.calc_air_time(now_zulu) or 0.0
+        values["landings"] = flight_log.landings
+        values["night_landings"] = flight_log.night_landings
+
+    def _read_value(self, refCon):
+        return self._values[refCon]
+
+    def _read_data(self, refCon, values, offset, count):
+        data = self._values[refCon]
+        if values is None:
+            return len(data)
+
+        chunk = data[offset:offset + count]
+        values.extend(chunk)
+
+        return len(chunk)
@@ -0,0 +1,140 @@
+"""
+env_channels.py
+
+Delta-encoded weather channels for track files, and a vectorized decoder.
+
+Notes
+-----
+* Each channel is quantized (see CHANNELS) and written as the change from
+  the previous record. An unchanged value is written as an empty field, so
+  long runs of steady weather cost one comma per channel per record.
+* The first record of a file holds the absolute quantized values.
+* Wind direction deltas are wrapped to [-180, 180) degrees and decoded
+  modulo 360.
+"""
+import numpy as np
+
+from logbook.track_file import read_columns
+
+# Track file column, quantum & whether the channel wraps around at 360.
+CHANNELS = (
+    ("envWindDir", 1.0, True),    # degrees true
+    ("envWindSpd", 1.0, False),   # knots
+    ("envOAT", 0.5, False),       # degrees C
+    ("envQNH", 0.01, False),      # inches of mercury
+)
+
+
+class EnvEncoder:
+    """
+    Delta-encode environment values for consecutive track records.
+    """
+
+    def __init__(self):
+        self._prev = [0] * len(CHANNELS)
+
+    def encode(self, values):
+        """
+        Encode one record's environment values.
+
+        Parameters
+        ----------
+        values : tuple of float
+            Wind direction (degrees true), wind speed (knots), outside air
+            temperature (degrees C) & QNH (inches of mercury), as returned by
+            Aircraft.environment().
+
+        Returns
+        -------
+        dict
+            Track file column -> encoded field.
+        """
+        fields = {}
+        for i, ((column, quantum, wraps), value) in enumerate(
+                zip(CHANNELS, values)):
+            quantized = round(value / quantum)
+            delta = quantized - self._prev[i]
+            if wraps:
+                steps = round(360 / quantum)
+                delta = (delta + steps // 2) % steps - steps // 2
+
+            self._prev[i] += delta
+            fields[column] = str(delta) if delta else ''
+
+        return fields
+
+
+def decode(track):
+    """
+    Decode the environment channels of a whole track in one pass.
+
+    Parameters
+    ----------
+    track : numpy structured array
+        Track file environment columns, with empty fields read as NaN.
+
+    Returns
+    -------
+    dict
+        Track file column -> numpy.ndarray of decoded values.
+    """
+    decoded = {}
+    for column, quantum, wraps in CHANNELS:
+        deltas = np.nan_to_num(np.asarray(track[column], dtype=np.float64))
+        values = np.cumsum(deltas) * quantum
+        if wraps:
+            values %= 360
+
+        decoded[column] = values
+
+    return decoded
+
+
+def wind_components(wind_dir, wind_speed, heading):
+    """
+    Headwind & crosswind components.
+
+    Parameters
+    ----------
+    wind_dir : numpy.ndarray
+        Direction the wind is blowing from, in degrees true.
+    wind_speed : numpy.ndarray
+        Wind speed.
+    heading : numpy.ndarray
+        Aircraft true heading, in degrees.
+
+    Returns
+    -------
+    numpy.ndarray, numpy.ndarray
+        Headwind (negative for a tailwind) & crosswind (positive from the
+        right) components, in the units of wind_speed.
+    """
+    relative = np.radians(np.asarray(wind_dir) - np.asarray(heading))
+    wind_speed = np.asarray(wind_speed)
+
+    return wind_speed * np.cos(relative), wind_speed * np.sin(relative)
+
+
+def read_track_env(track_file):
+    """
+    Read & decode the environment channels of a track file written by
+    PI_TrackLog, along with head & crosswind components.
+
+    Parameters
+    ----------
+    track_file : pathlib.Path
+
+    Returns
+    -------
+    dict
+        Decoded channels (see decode()), plus 'headwind' & 'crosswind' in
+        knots.
+    """
+    columns = [column for column, _, _ in CHANNELS] + ['currHdg']
+    track = read_columns(track_file, columns)
+
+    env = decode(track)
+    env['headwind'], env['crosswind'] = wind_components(
+        env['envWindDir'], env['envWindSpd'], track['currHdg'])
+
+    return env
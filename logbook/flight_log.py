@@ -1,6 +1,8 @@
 from datetime import datetime, timedelta
 import os
 
+from logbook.flight_stats import FlightStats
+
 
 class FlightLog:
     """
@@ -21,6 +23,9 @@ class FlightLog:
 
         self._origin = None
         self._dest = None
+        self._planned_distance = None
+        self._dep_rwy = None
+        self._arr_rwy = None
 
         self._out_local = None
         self._off_local = None
@@ -32,12 +37,20 @@ class FlightLog:
         self._on_zulu = None
         self._in_zulu = None
 
+        # Event times in zulu seconds since midnight, for time calculations.
+        self._event_secs = {}
+        # Seconds of air & block time from completed legs, e.g. earlier
+        # circuits of touch-and-goes.
+        self._completed_secs = {'air': 0.0, 'block': 0.0}
+
         self._air_time = None
         self._block_time = None
 
         self._num_landings = 0
         self._num_landings_night = 0
 
+        self._stats = FlightStats()
+
     @property
     def aircraft_type(self):
         return self._acft_type
@@ -62,6 +75,22 @@ class FlightLog:
     def air_time(self, air_time):
         self._air_time = air_time
 
+    @property
+    def arrival_runway(self):
+        return self._arr_rwy
+
+    @arrival_runway.setter
+    def arrival_runway(self, runway):
+        self._arr_rwy = runway
+
+    @property
+    def avg_groundspeed(self):
+        speed = self._stats.speed_ground_avg
+        if speed is None:
+            return None
+
+        return round(speed * 1.94384)
+
     @property
     def block_time(self):
         return self._block_time
@@ -74,6 +103,14 @@ class FlightLog:
     def date(self):
         return self._date
 
+    @property
+    def departure_runway(self):
+        return self._dep_rwy
+
+    @departure_runway.setter
+    def departure_runway(self, runway):
+        self._dep_rwy = runway
+
     @property
     def destination(self):
         return self._dest
@@ -82,10 +119,26 @@ class FlightLog:
     def destination(self, dest):
         self._dest = dest
 
+    @property
+    def distance_flown(self):
+        return self._round(self._stats.distance_flown, 1)
+
+    @property
+    def distance_gc(self):
+        return self._round(self._stats.distance_gc, 1)
+
     @property
     def landings(self):
         return self._num_landings
 
+    @property
+    def max_altitude(self):
+        alt = self._stats.altitude_max
+        if alt is None:
+            return None
+
+        return round(alt * 3.28084)
+
     @property
     def night_landings(self):
         return self._num_landings_night
@@ -98,44 +151,74 @@ class FlightLog:
     def origin(self, origin):
         self._origin = origin
 
-    def calc_air_time(self):
-        return self._calc_time_diff('air')
+    @property
+    def planned_distance(self):
+        return self._planned_distance
+
+    @planned_distance.setter
+    def planned_distance(self, distance):
+        self._planned_distance = self._round(distance, 1)
+
+    @property
+    def route_efficiency(self):
+        return self._round(self._stats.route_efficiency, 3)
+
+    def calc_air_time(self, now_zulu=None):
+        return self._calc_time_diff('air', now_zulu)
+
+    def calc_block_time(self, now_zulu=None):
+        return self._calc_time_diff('block', now_zulu)
 
-    def calc_block_time(self):
-        return self._calc_time_diff('block')
+    # Time -> start & end events
+    TIME_EVENTS = {'air': ('off', 'on'), 'block': ('out', 'in')}
 
-    def _calc_time_diff(self, time_kword):
+    def _calc_time_diff(self, time_kword, now_zulu=None):
         """
-        Calculate the difference in time between two time variables.
+        Calculate the total time between start & end events, i.e. the time
+        of completed legs plus the current leg.
 
         Parameters
         ----------
         time_kword : str
-            Time to calculate, i.e. 'air' for air time or 'blocl' for block time.
+            Time to calculate, i.e. 'air' for air time or 'block' for block
+            time.
+        now_zulu : int, optional
+            Current zulu time, in seconds since midnight. If given and the
+            end event of the current leg hasn't happened yet, the time
+            elapsed so far is included.
 
         Returns
         -------
         float
         """
-        if time_kword == 'air':
-            time1 = self._off_zulu
-            time2 = self._on_zulu
-        elif time_kword == 'block':
-            time1 = self._out_zulu
-            time2 = self._in_zulu
-        else:
+        if time_kword not in self.TIME_EVENTS:
             raise ValueError(f'Invalid time_kword argument {time_kword}')
 
-        try:
-            time_diff = time2 - time1
-        except TypeError:
-            # One or more of the time variables needed have not been set
+        start, end = self.TIME_EVENTS[time_kword]
+        time1 = self._event_secs.get(start)
+        time2 = self._event_secs.get(end, now_zulu)
+
+        completed = self._completed_secs[time_kword]
+        if time1 is None:
+            # The time variables needed have not been set
             return
 
+        if time2 is None:
+            if not completed:
+                return
+            time_diff = 0.0
+        else:
+            time_diff = self._secs_between(time1, time2)
+
+        return FlightLog.seconds2hours(completed + time_diff)
+
+    @staticmethod
+    def _secs_between(time1, time2):
+        time_diff = time2 - time1
         if time_diff < 0:
             time_diff += (24 * 3600)
 
-        return FlightLog.seconds2hours(time_diff)
+        return time_diff
 
     def get_timestrings_local(self):
         t_out = FlightLog.seconds2hours_str(self._out_local)
@@ -146,10 +229,33 @@ class FlightLog:
         return t_out, t_off, t_on, t_in
 
     def inc_landing_count(self, night=False):
+        self._num_landings += 1
         if night:
             self._num_landings_night += 1
-        else:
-            self._num_landings += 1
+
+    def update_track(self, lon, lat, alt_msl, speed_ground, airborne=True):
+        """
+        Update the flight's distance & performance statistics with the
+        aircraft's latest position.
+
+        Parameters
+        ----------
+        lon : float
+            Longitude, in decimal degrees.
+        lat : float
+            Latitude, in decimal degrees.
+        alt_msl : float
+            Altitude MSL, in meters.
+        speed_ground : float
+            Ground speed, in meters/second.
+        airborne : bool, optional
+            Whether the aircraft is in the air.
+
+        Returns
+        -------
+        None.
+        """
+        self._stats.update(lon, lat, alt_msl, speed_ground, airborne)
 
     def mark_time(self, time_var, time_local, time_zulu):
         """
@@ -168,6 +274,16 @@ class FlightLog:
         -------
         None.
         """
+        for time_kword, (start, end) in self.TIME_EVENTS.items():
+            if time_var == start and end in self._event_secs:
+                # A new leg, e.g. a touch-and-go: bank the completed leg and
+                # drop its end event so it isn't paired with the new start.
+                self._completed_secs[time_kword] += self._secs_between(
+                    self._event_secs[start], self._event_secs.pop(end))
+
+        if time_var in ('out', 'off', 'on', 'in'):
+            self._event_secs[time_var] = time_zulu
+
         time_local = self.seconds2hours_str(time_local)
         time_zulu = self.seconds2hours_str(time_zulu)
 
@@ -187,6 +303,13 @@ class FlightLog:
             case _:
                 raise ValueError(f'Invalid timeVar argument {time_var}')
 
+    @staticmethod
+    def _round(value, ndigits):
+        if value is None:
+            return None
+
+        return round(value, ndigits)
+
     @staticmethod
     def seconds2hours(seconds):
         """
@@ -241,6 +364,8 @@ class FlightLog:
             'acft_type': '_acft_type',
             'origin': '_origin',
             'destination': '_dest',
+            'departure_runway': '_dep_rwy',
+            'arrival_runway': '_arr_rwy',
             'out_local': '_out_local',
             'off_local': '_off_local',
             'on_local': '_on_local',
@@ -252,10 +377,17 @@ class FlightLog:
             'air_time': '_air_time',
             'block_time': '_block_time',
             'num_landings': '_num_landings',
+            'num_landings_night': '_num_landings_night',
+            'distance_flown_nm': 'distance_flown',
+            'distance_gc_nm': 'distance_gc',
+            'planned_distance_nm': '_planned_distance',
+            'max_altitude_ft': 'max_altitude',
+            'avg_groundspeed_kts': 'avg_groundspeed',
+            'route_efficiency': 'route_efficiency',
         }
 
         log_vals = [getattr(self, x) for x in log_attrs.values()]
-        log_vals = [x if x is not None else 'NA' for x in log_vals]
+        log_vals = [str(x) if x is not None else 'NA' for x in log_vals]
         log_line = ','.join(log_vals)
 
         if output_file.is_file():
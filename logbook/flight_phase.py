@@ -1,7 +1,18 @@
 """
 flight_phase.py
 
+Table-driven flight phase state machine.
+
+Notes
+-----
+* The transitions out of each phase are declared in FlightPhase.RULES and
+  checked when this module is imported, so a typo in a rule fails at load
+  rather than in a running sim.
+* Only the rules of the current phase are evaluated, and each aircraft input
+  is read at most once per update. In cruise, for example, only the
+  vertical speed is read.
 """
+import operator
 
 
 class FlightPhase(object):
@@ -25,15 +36,139 @@ class FlightPhase(object):
     PHASE_LANDING = 'PHASE_LANDING'
     PHASE_TAXI_IN = 'PHASE_TAXI_IN'
 
-    def __init__(self, aircraft):
+    PHASES = (
+        PHASE_RAMP,
+        PHASE_TAXI_OUT,
+        PHASE_TAKEOFF,
+        PHASE_CLIMB,
+        PHASE_CRUISE,
+        PHASE_DESCENT,
+        PHASE_LANDING,
+        PHASE_TAXI_IN,
+    )
+
+    # Aircraft inputs the rules can use, and the Aircraft method reading each.
+    INPUTS = {
+        'altitude_agl': 'altitude_agl',
+        'engine_running': 'is_engine_running',
+        'on_ground': 'is_on_ground',
+        'speed_ground': 'speed_ground',
+        'speed_ias': 'speed_ias',
+        'speed_vertical': 'speed_vertical',
+        'stopped': 'is_stopped',
+    }
+
+    OPERATORS = {
+        '<': operator.lt,
+        '<=': operator.le,
+        '>': operator.gt,
+        '>=': operator.ge,
+        '==': operator.eq,
+        'abs<': lambda value, limit: abs(value) < limit,
+    }
+
+    DEFAULT_THRESHOLDS = {
+        'takeoff_ias': 35,          # knots
+        'takeoff_agl': 500,         # meters
+        'climb_vs': 200,            # feet/minute
+        'climb_agl': 100,           # meters
+        'descent_vs': -200,         # feet/minute
+        'cruise_descent_vs': -500,  # feet/minute
+        'approach_agl': 500,        # meters
+        'taxi_in_speed': 35,        # meters/second
+    }
+
+    # Threshold overrides, by aircraft ICAO type code.
+    AIRCRAFT_THRESHOLDS = {}
+
+    # Transitions out of each phase, checked in order; the first rule whose
+    # conditions all hold wins. A condition is (input, operator, value),
+    # where value is either the name of a threshold or a literal.
+    RULES = {
+        PHASE_RAMP: (
+            (PHASE_TAXI_OUT, (
+                ('engine_running', '==', True),
+                ('stopped', '==', False))),
+        ),
+        PHASE_TAXI_OUT: (
+            (PHASE_TAKEOFF, (
+                ('speed_ias', '>', 'takeoff_ias'),
+                ('altitude_agl', '<', 'takeoff_agl'))),
+            (PHASE_RAMP, (
+                ('on_ground', '==', True),
+                ('stopped', '==', True),
+                ('engine_running', '==', False))),
+        ),
+        PHASE_TAKEOFF: (
+            (PHASE_CLIMB, (
+                ('speed_vertical', '>', 'climb_vs'),
+                ('altitude_agl', '>=', 'climb_agl'))),
+            (PHASE_LANDING, (
+                ('speed_vertical', '<', 'descent_vs'),
+                ('altitude_agl', '<', 'approach_agl'))),
+        ),
+        PHASE_CLIMB: (
+            (PHASE_CRUISE, (
+                ('speed_vertical', 'abs<', 'climb_vs'),)),
+            (PHASE_DESCENT, (
+                ('speed_vertical', '<', 'descent_vs'),)),
+        ),
+        PHASE_CRUISE: (
+            (PHASE_CLIMB, (
+                ('speed_vertical', '>', 'climb_vs'),)),
+            (PHASE_DESCENT, (
+                ('speed_vertical', '<', 'cruise_descent_vs'),)),
+        ),
+        PHASE_DESCENT: (
+            (PHASE_LANDING, (
+                ('altitude_agl', '<=', 'approach_agl'),)),
+        ),
+        PHASE_LANDING: (
+            # TODO: Add case for touch-n-go
+            (PHASE_TAXI_IN, (
+                ('on_ground', '==', True),
+                ('speed_ground', '<', 'taxi_in_speed'))),
+            (PHASE_CLIMB, (
+                ('speed_vertical', '>', 'climb_vs'),
+                ('altitude_agl', '>=', 'approach_agl'))),
+        ),
+        PHASE_TAXI_IN: (
+            (PHASE_RAMP, (
+                ('on_ground', '==', True),
+                ('engine_running', '==', False),
+                ('stopped', '==', True))),
+            (PHASE_TAKEOFF, (
+                ('speed_ias', '>', 'takeoff_ias'),
+                ('altitude_agl', '<', 'takeoff_agl'),
+                ('speed_vertical', '>', 'climb_vs'))),
+        ),
+    }
+
+    def __init__(self, aircraft, aircraft_type=None, thresholds=None):
         """
         Parameters
         ----------
         aircraft : Aircraft class
+        aircraft_type : str, optional
+            Aircraft ICAO type code, used to look up threshold overrides in
+            AIRCRAFT_THRESHOLDS.
+        thresholds : dict, optional
+            Threshold overrides, applied on top of the aircraft type's.
         """
         self._aircraft = aircraft
         self._phase = self.PHASE_RAMP
 
+        merged = dict(self.DEFAULT_THRESHOLDS)
+        merged.update(self.AIRCRAFT_THRESHOLDS.get(aircraft_type, {}))
+        merged.update(thresholds or {})
+        self.check_thresholds(merged)
+        self._thresholds = merged
+
+        self._readers = {
+            name: getattr(aircraft, method)
+            for name, method in self.INPUTS.items()}
+        self._rules = self.compile_rules(self.RULES, merged)
+
     @property
     def phase(self):
         return self._phase
@@ -42,67 +177,135 @@ class FlightPhase(object):
     def phase(self, new_phase):
         self._phase = new_phase
 
+    @property
+    def thresholds(self):
+        return dict(self._thresholds)
+
     def update(self):
         prev_phase = self._phase
 
-        if self._phase == self.PHASE_RAMP:
-            if self._aircraft.is_engine_running() and not self._aircraft.is_stopped():
-                self._phase = self.PHASE_TAXI_OUT
+        # Inputs read during this update. Each is read at most once, and only
+        # if a rule of the current phase needs it.
+        inputs = {}
+
+        def read(name):
+            try:
+                return inputs[name]
+            except KeyError:
+                value = inputs[name] = self._readers[name]()
+                return value
+
+        for next_phase, conditions in self._rules[self._phase]:
+            if all(op(read(name), value) for name, op, value in conditions):
+                self._phase = next_phase
+                break
+
+        return self._phase == prev_phase
+
+    @classmethod
+    def check_rules(cls, rules, thresholds):
+        """
+        Validate a rule table.
 
-        elif self._phase == self.PHASE_TAXI_OUT:
-            if self._aircraft.speed_ias() > 35 and self._aircraft.altitude_agl() < 500:
-                self._phase = self.PHASE_TAKEOFF
+        Parameters
+        ----------
+        rules : dict
+            See RULES.
+        thresholds : dict
+            Threshold names & values the rules may refer to.
 
-            elif (self._aircraft.is_on_ground() and
-                    self._aircraft.is_stopped() and
-                    not self._aircraft.is_engine_running()):
-                self._phase = self.PHASE_RAMP
+        Returns
+        -------
+        None.
 
-        elif self.phase == self.PHASE_TAKEOFF:
-            if (self._aircraft.speed_vertical() > 200 and
-                    self._aircraft.altitude_agl() >= 100):
-                self._phase = self.PHASE_CLIMB
+        Raises
+        ------
+        ValueError
+            If a rule refers to an unknown phase, input, operator or
+            threshold.
+        """
+        for phase, transitions in rules.items():
+            if phase not in cls.PHASES:
+                raise ValueError(f'Invalid phase {phase} in rules')
 
-            elif (self._aircraft.verticalspeed() < -200 and
-                    self._aircraft.altitude_agl() < 500):
-                self._phase = self.PHASE_LANDING
+            for next_phase, conditions in transitions:
+                if next_phase not in cls.PHASES:
+                    raise ValueError(
+                        f'Invalid phase {next_phase} in {phase} rules')
 
-        elif self.phase == self.PHASE_CLIMB:
-            if abs(self._aircraft.speed_vertical()) < 200:
-                self._phase = self.PHASE_CRUISE
+                for name, op, value in conditions:
+                    if name not in cls.INPUTS:
+                        raise ValueError(
+                            f'Invalid input {name} in {phase} rules')
+                    if op not in cls.OPERATORS:
+                        raise ValueError(
+                            f'Invalid operator {op} in {phase} rules')
+                    if isinstance(value, str) and value not in thresholds:
+                        raise ValueError(
+                            f'Invalid threshold {value} in {phase} rules')
 
-            elif self._aircraft.speed_vertical() < -200:
-                self._phase = self.PHASE_DESCENT
+        missing = set(cls.PHASES) - set(rules)
+        if missing:
+            raise ValueError(f'No rules for phases {sorted(missing)}')
 
-        elif self.phase == self.PHASE_CRUISE:
-            if self._aircraft.speed_vertical() > 200:
-                self._phase = self.PHASE_CLIMB
+    @classmethod
+    def check_thresholds(cls, thresholds):
+        """
+        Validate threshold overrides.
 
-            elif self._aircraft.speed_vertical() < -500:
-                self._phase = self.PHASE_DESCENT
+        Parameters
+        ----------
+        thresholds : dict
 
-        elif self.phase == self.PHASE_DESCENT:
-            if self._aircraft.altitude_agl() <= 500:
-                self._phase = self.PHASE_LANDING
+        Returns
+        -------
+        None.
 
-        elif self.phase == self.PHASE_LANDING:
-            # TODO: Add case for touch-n-go
-            if self._aircraft.is_on_ground() and self._aircraft.speed_ground() < 35:
-                self._phase = self.PHASE_TAXI_IN
+        Raises
+        ------
+        ValueError
+            If a threshold name is unknown or its value isn't a number.
+        """
+        for name, value in thresholds.items():
+            if name not in cls.DEFAULT_THRESHOLDS:
+                raise ValueError(f'Invalid threshold {name}')
+            if not isinstance(value, (int, float)):
+                raise ValueError(f'Invalid value {value!r} for {name}')
 
-            elif (self._aircraft.speed_vertical() > 200 and
-                  self._aircraft.altitude_agl() >= 500):
-                self._phase = self.PHASE_CLIMB
+    @classmethod
+    def compile_rules(cls, rules, thresholds):
+        """
+        Compile a rule table into a state machine, resolving operators &
+        threshold names.
+
+        Parameters
+        ----------
+        rules : dict
+            See RULES.
+        thresholds : dict
+            Threshold names & values.
 
-        elif self.phase == self.PHASE_TAXI_IN:
-            if (self._aircraft.isonground() and
-                    not self._aircraft.isenginerunning() and
-                    self._aircraft.isstopped()):
-                self._phase = self.PHASE_RAMP
+        Returns
+        -------
+        dict
+            Phase -> tuple of (next phase, ((input, operator function,
+            value), ...)).
+        """
+        cls.check_rules(rules, thresholds)
 
-            if (self._aircraft.speed_ias() > 35 and
-                    self._aircraft.altitude_agl() < 500 and
-                    self._aircraft.speed_vertical() > 200):
-                self._phase = self.PHASE_TAKEOFF
+        compiled = {}
+        for phase, transitions in rules.items():
+            compiled[phase] = tuple(
+                (next_phase, tuple(
+                    (name, cls.OPERATORS[op],
+                     thresholds[value] if isinstance(value, str) else value)
+                    for name, op, value in conditions))
+                for next_phase, conditions in transitions)
 
-        return self._phase == prev_phase
+        return compiled
+
+
+# Fail at import, not in a running sim, if the rule tables have a typo.
+FlightPhase.check_rules(FlightPhase.RULES, FlightPhase.DEFAULT_THRESHOLDS)
+for _thresholds in FlightPhase.AIRCRAFT_THRESHOLDS.values():
+    FlightPhase.check_thresholds(_thresholds)
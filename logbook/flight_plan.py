@@ -0,0 +1,106 @@
+"""
+flight_plan.py
+
+Change-tracked cache of the flight plan loaded in the FMS.
+
+Notes
+-----
+* The FMS entries are only walked when the number of entries or the
+  destination entry index changes, so refresh() costs two SDK calls per tick.
+* Distances are in nautical miles.
+"""
+from XPPython3 import xp
+
+from logbook.flight_stats import haversine
+
+
+class FlightPlan:
+    """
+    Origin, destination & planned route distance of the FMS flight plan.
+
+    Parameters
+    ----------
+    aircraft : Aircraft class
+        Used to find the nearest airport when no flight plan is loaded.
+    """
+
+    def __init__(self, aircraft):
+        self._aircraft = aircraft
+
+        self._n_entries = None
+        self._dest_index = None
+
+        self._origin = None
+        self._dest = None
+        self._distance = None
+        self._nearest_origin = None
+
+    @property
+    def destination(self):
+        """Destination airport ID, or None if the plan has no destination."""
+        return self._dest
+
+    @property
+    def distance(self):
+        """Planned route distance, in nautical miles."""
+        return self._distance
+
+    @property
+    def loaded(self):
+        return bool(self._n_entries)
+
+    @property
+    def origin(self):
+        """
+        Origin airport ID. Falls back to the airport nearest to the aircraft
+        when the plan has no origin.
+        """
+        if self._origin is not None:
+            return self._origin
+
+        if self._nearest_origin is None:
+            self._nearest_origin = self._aircraft.nearest_airport().navAidID
+
+        return self._nearest_origin
+
+    def refresh(self):
+        """
+        Re-read the FMS flight plan if it has changed since the last call.
+
+        Returns
+        -------
+        bool
+            True if the flight plan changed.
+        """
+        n_entries = xp.countFMSEntries()
+        dest_index = xp.getDestinationFMSEntry()
+
+        if n_entries == self._n_entries and dest_index == self._dest_index:
+            return False
+
+        self._n_entries = n_entries
+        self._dest_index = dest_index
+        self._read_entries()
+
+        return True
+
+    def _read_entries(self):
+        entries = [xp.getFMSEntryInfo(i) for i in range(self._n_entries)]
+        airports = [e for e in entries if e.type == xp.Nav_Airport]
+
+        self._origin = None
+        self._dest = None
+        self._distance = None
+
+        if not entries:
+            return
+
+        if entries[0].type == xp.Nav_Airport:
+            self._origin = entries[0].navAidID
+
+        if airports and airports[-1] is not entries[0]:
+            self._dest = airports[-1].navAidID
+
+        self._distance = sum(
+            haversine(prev.lon, prev.lat, curr.lon, curr.lat)
+            for prev, curr in zip(entries[:-1], entries[1:]))
@@ -0,0 +1,431 @@
+"""
+flight_recorder.py
+
+"Black box" flight data recorder. Every dataref in Aircraft.DATAREFS is
+recorded into a fixed-size in-memory ring buffer at frame rate, and the
+buffer is dumped to disk as a compact binary snapshot only when a trigger
+fires.
+
+Notes
+-----
+* The ring buffer is allocated once; memory use does not grow with flight
+  length.
+* On a trigger the flight loop only copies the buffer; the file is written
+  by a background writer thread.
+* Snapshot layout (little-endian):
+    * magic b'XPBB', version (uint16), n_rows (uint32), n_cols (uint16)
+    * metadata length (uint32) followed by UTF-8 JSON metadata
+    * n_rows x n_cols float32 values, row-major. Column 0 is sim time.
+"""
+from datetime import datetime
+import json
+import queue
+import struct
+import threading
+
+import numpy as np
+
+from XPPython3 import xp
+
+
+class Trigger:
+    """
+    Base class for black box triggers. Subclasses implement check(), which
+    is called once per recorded frame and returns True when a snapshot
+    should be dumped.
+    """
+    name = 'trigger'
+
+    def check(self, recorder):
+        raise NotImplementedError
+
+
+class HardLandingTrigger(Trigger):
+    """
+    Fires on touchdown when the vertical speed just before touchdown is below
+    a limit.
+
+    Parameters
+    ----------
+    vs_limit : float, optional
+        Vertical speed limit, in feet/minute. Default is -600.
+    """
+    name = 'hard_landing'
+
+    def __init__(self, vs_limit=-600.0):
+        self._vs_limit = vs_limit
+        self._prev_on_ground = True
+        self._prev_vs = 0.0
+
+    def check(self, recorder):
+        on_ground = recorder.current('wheels_on_ground') > 0
+        vs = recorder.current('speed_vertical')
+
+        fired = (on_ground and not self._prev_on_ground and
+                 self._prev_vs <= self._vs_limit)
+
+        self._prev_on_ground = on_ground
+        self._prev_vs = vs
+
+        return fired
+
+
+class OverspeedTrigger(Trigger):
+    """
+    Fires when the indicated airspeed rises above a limit.
+
+    Parameters
+    ----------
+    ias_limit : float
+        Airspeed limit, in knots.
+    """
+    name = 'overspeed'
+
+    def __init__(self, ias_limit):
+        self._ias_limit = ias_limit
+        self._over = False
+
+    def check(self, recorder):
+        over = recorder.current('speed_ias') > self._ias_limit
+        fired = over and not self._over
+        self._over = over
+
+        return fired
+
+
+class PhaseFlapTrigger(Trigger):
+    """
+    Fires when the flight phase changes too many times within a time window.
+
+    Parameters
+    ----------
+    max_changes : int, optional
+        Number of phase changes allowed within the window. Default is 4.
+    window : float, optional
+        Window length, in seconds of sim time. Default is 60.
+    """
+    name = 'phase_flap'
+
+    def __init__(self, max_changes=4, window=60.0):
+        self._max_changes = max_changes
+        self._window = window
+        self._prev_phase = None
+        self._changes = []
+
+    def check(self, recorder):
+        phase = recorder.phase
+        now = recorder.current('time')
+
+        if self._prev_phase is not None and phase != self._prev_phase:
+            self._changes.append(now)
+        self._prev_phase = phase
+
+        while self._changes and now - self._changes[0] > self._window:
+            self._changes.pop(0)
+
+        if len(self._changes) > self._max_changes:
+            self._changes.clear()
+            return True
+
+        return False
+
+
+class FlightRecorder:
+    """
+    Frame-rate ring buffer of aircraft datarefs with triggered dumps.
+
+    Parameters
+    ----------
+    aircraft : Aircraft class
+    output_dir : pathlib.Path
+        Directory snapshots are written to.
+    capacity : int, optional
+        Number of frames kept in the ring buffer. Default is 3600, or about
+        one minute at 60 fps.
+    triggers : list of Trigger, optional
+        Triggers to check on each frame. Default is a hard landing trigger
+        and a phase flapping trigger.
+    cooldown : float, optional
+        Minimum sim time between two snapshots, in seconds. Default is 30.
+    """
+
+    # Dataref value type & number of values recorded for each key in
+    # Aircraft.DATAREFS. String datarefs are stored in the snapshot metadata
+    # instead of the ring buffer.
+    MAX_ENGINES = 8
+    DATAREF_TYPES = {
+        "altitude_agl": ("f", 1),
+        "altitude_msl": ("d", 1),
+        "day_of_year": ("i", 1),
+        "eng_num": ("i", 1),
+        "eng_throttle": ("vf", MAX_ENGINES),
+        "eng_running": ("vi", MAX_ENGINES),
+        "flight_time": ("f", 1),
+        "gear_fnrml": ("f", 1),
+        "heading_true": ("f", 1),
+        "icao_type": ("s", 0),
+        "latitude": ("d", 1),
+        "local_time": ("f", 1),
+        "longitude": ("d", 1),
+        "magnetic_variation": ("f", 1),
+        "oat": ("f", 1),
+        "parking_brake": ("f", 1),
+        "qnh": ("f", 1),
+        "speed_ground": ("f", 1),
+        "speed_ias": ("f", 1),
+        "speed_vertical": ("f", 1),
+        "sun_pitch": ("f", 1),
+        "wheels_on_ground": ("i", 1),
+        "wind_direction": ("f", 1),
+        "wind_speed": ("f", 1),
+        "zulu_time": ("f", 1),
+    }
+
+    SNAPSHOT_MAGIC = b'XPBB'
+    SNAPSHOT_VERSION = 1
+
+    def __init__(self, aircraft, output_dir, capacity=3600, triggers=None,
+                 cooldown=30.0):
+        missing = set(aircraft.DATAREFS) - set(self.DATAREF_TYPES)
+        if missing:
+            raise ValueError(
+                f'No recorder type for datarefs {sorted(missing)}')
+
+        self._aircraft = aircraft
+        self._output_dir = output_dir
+        self._capacity = capacity
+        self._cooldown = cooldown
+        if triggers is None:
+            triggers = [HardLandingTrigger(), PhaseFlapTrigger()]
+        self._triggers = triggers
+
+        self._time_ref = xp.findDataRef("sim/time/total_flight_time_sec")
+        self._channels = []
+        self._strings = []
+        self._columns = ['time']
+        for key, (kind, count) in self.DATAREF_TYPES.items():
+            ref = xp.findDataRef(aircraft.DATAREFS[key])
+            if kind == 's':
+                self._strings.append((key, ref))
+                continue
+
+            col = len(self._columns)
+            if count == 1:
+                self._columns.append(key)
+            else:
+                self._columns.extend(f'{key}_{i}' for i in range(count))
+            self._channels.append((col, ref, kind, count, [0] * count))
+
+        self._col_index = {name: i for i, name in enumerate(self._columns)}
+        self._buffer = np.zeros(
+            (capacity, len(self._columns)), dtype=np.float64)
+        self._head = 0
+        self._full = False
+        self._row = self._buffer[0]
+        self._phase = None
+        self._last_dump = None
+
+        self._queue = queue.SimpleQueue()
+        self._writer = None
+
+    @property
+    def columns(self):
+        return list(self._columns)
+
+    @property
+    def phase(self):
+        return self._phase
+
+    def current(self, name):
+        """
+        Value of a channel in the most recently recorded frame.
+
+        Parameters
+        ----------
+        name : str
+            Channel name, e.g. 'speed_ias' or 'eng_running_0'.
+
+        Returns
+        -------
+        float
+        """
+        return self._row[self._col_index[name]]
+
+    def record(self, phase=None):
+        """
+        Record the current value of every dataref into the ring buffer and
+        check the triggers. Call once per frame from the flight loop.
+
+        Parameters
+        ----------
+        phase : str, optional
+            Current flight phase.
+
+        Returns
+        -------
+        bool
+            True if a snapshot was queued for writing.
+        """
+        row = self._buffer[self._head]
+        now = xp.getDataf(self._time_ref)
+        row[0] = now
+
+        for col, ref, kind, count, values in self._channels:
+            if kind == 'f':
+                row[col] = xp.getDataf(ref)
+            elif kind == 'd':
+                row[col] = xp.getDatad(ref)
+            elif kind == 'i':
+                row[col] = xp.getDatai(ref)
+            elif kind == 'vf':
+                n = xp.getDatavf(ref, values, 0, count)
+                row[col:col + n] = values[:n]
+            elif kind == 'vi':
+                n = xp.getDatavi(ref, values, 0, count)
+                row[col:col + n] = values[:n]
+
+        self._row = row
+        self._phase = phase
+        self._head += 1
+        if self._head == self._capacity:
+            self._head = 0
+            self._full = True
+
+        fired = [t.name for t in self._triggers if t.check(self)]
+        if not fired:
+            return False
+
+        if (self._last_dump is not None and
+                now - self._last_dump < self._cooldown):
+            return False
+
+        self._last_dump = now
+        self.dump('+'.join(fired))
+
+        return True
+
+    def snapshot(self):
+        """
+        Copy the ring buffer contents in chronological order.
+
+        Returns
+        -------
+        numpy.ndarray
+            Array of shape (n_rows, n_cols), oldest frame first.
+        """
+        if not self._full:
+            return self._buffer[:self._head].copy()
+
+        return np.concatenate(
+            (self._buffer[self._head:], self._buffer[:self._head]))
+
+    def dump(self, reason='manual'):
+        """
+        Queue a snapshot of the ring buffer to be written to disk by the
+        writer thread.
+
+        Parameters
+        ----------
+        reason : str, optional
+            Name of the trigger(s) that caused the dump.
+
+        Returns
+        -------
+        None.
+        """
+        meta = {
+            'reason': reason,
+            'phase': self._phase,
+            'columns': self._columns,
+        }
+        for key, ref in self._strings:
+            meta[key] = xp.getDatas(ref)
+
+        if self._writer is None or not self._writer.is_alive():
+            self._writer = threading.Thread(
+                target=self._write_loop, name='FlightRecorderWriter',
+                daemon=True)
+            self._writer.start()
+
+        self._queue.put((datetime.now(), meta, self.snapshot()))
+
+    def stop(self):
+        """
+        Flush any queued snapshots and stop the writer thread.
+
+        Returns
+        -------
+        None.
+        """
+        if self._writer is not None and self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join(timeout=10.0)
+        self._writer = None
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            timestamp, meta, data = item
+            fname = (f'BlackBox-{timestamp.strftime("%Y_%m_%d-%H%M%S")}'
+                     f'-{meta["reason"]}.bin')
+            self._output_dir.mkdir(parents=True, exist_ok=True)
+            self.write_snapshot(self._output_dir.joinpath(fname), meta, data)
+
+    @classmethod
+    def write_snapshot(cls, output_file, meta, data):
+        """
+        Write a snapshot to a binary file.
+
+        Parameters
+        ----------
+        output_file : pathlib.Path
+        meta : dict
+            JSON-serializable snapshot metadata.
+        data : numpy.ndarray
+            Array of shape (n_rows, n_cols).
+
+        Returns
+        -------
+        None.
+        """
+        meta_bytes = json.dumps(meta).encode('utf-8')
+        n_rows, n_cols = data.shape
+
+        with open(output_file, 'wb') as f_out:
+            f_out.write(struct.pack(
+                '<4sHIH', cls.SNAPSHOT_MAGIC, cls.SNAPSHOT_VERSION,
+                n_rows, n_cols))
+            f_out.write(struct.pack('<I', len(meta_bytes)))
+            f_out.write(meta_bytes)
+            f_out.write(data.astype('<f4').tobytes())
+
+    @classmethod
+    def read_snapshot(cls, input_file):
+        """
+        Read a snapshot written by write_snapshot().
+
+        Parameters
+        ----------
+        input_file : pathlib.Path
+
+        Returns
+        -------
+        dict, numpy.ndarray
+            Snapshot metadata and an array of shape (n_rows, n_cols).
+        """
+        with open(input_file, 'rb') as f_in:
+            magic, version, n_rows, n_cols = struct.unpack(
+                '<4sHIH', f_in.read(struct.calcsize('<4sHIH')))
+            if magic != cls.SNAPSHOT_MAGIC:
+                raise ValueError(f'{input_file} is not a black box snapshot')
+            if version != cls.SNAPSHOT_VERSION:
+                raise ValueError(f'Unsupported snapshot version {version}')
+
+            meta_len, = struct.unpack('<I', f_in.read(4))
+            meta = json.loads(f_in.read(meta_len).decode('utf-8'))
+            data = np.frombuffer(f_in.read(), dtype='<f4')
+
+        return meta, data.reshape(n_rows, n_cols)
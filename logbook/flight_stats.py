@@ -0,0 +1,148 @@
+"""
+flight_stats.py
+
+Incremental flight performance accumulators. Each position update is folded
+into running totals in constant time & memory, so the full track never has
+to be kept in memory.
+
+Notes
+-----
+* Accumulators are kept in the simulator's native units (meters,
+  meters/second). Distances are returned in nautical miles.
+"""
+import math
+
+EARTH_RADIUS_NM = 3440.065
+
+
+def haversine(lon1, lat1, lon2, lat2):
+    """
+    Great-circle distance between two points.
+
+    Parameters
+    ----------
+    lon1, lat1 : float
+        Longitude & latitude of the first point, in decimal degrees.
+    lon2, lat2 : float
+        Longitude & latitude of the second point, in decimal degrees.
+
+    Returns
+    -------
+    float
+        Distance, in nautical miles.
+    """
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+
+    a = (math.sin(d_phi / 2) ** 2 +
+         math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2)
+
+    return 2 * EARTH_RADIUS_NM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class FlightStats:
+    """
+    Running distance, altitude & speed statistics for a single flight.
+    """
+
+    def __init__(self):
+        self._first = None
+        self._last = None
+        self._prev_airborne = None
+
+        self._distance = 0.0
+        self._alt_max = None
+        self._alt_min = None
+
+        self._n_speed = 0
+        self._speed_mean = 0.0
+
+    @property
+    def altitude_max(self):
+        """Highest airborne altitude MSL, in meters."""
+        return self._alt_max
+
+    @property
+    def altitude_min(self):
+        """Lowest airborne altitude MSL, in meters."""
+        return self._alt_min
+
+    @property
+    def distance_flown(self):
+        """Distance flown while airborne, in nautical miles."""
+        return self._distance
+
+    @property
+    def distance_gc(self):
+        """
+        Great-circle distance between the first and last airborne positions,
+        i.e. takeoff & landing, in nautical miles. Ramp & taxi positions are
+        excluded, so it covers the same path as distance_flown.
+        """
+        if self._first is None:
+            return None
+
+        return haversine(*self._first, *self._last)
+
+    @property
+    def route_efficiency(self):
+        """
+        Ratio of the great-circle distance to the distance flown. 1.0 is a
+        perfectly direct route.
+        """
+        if not self._distance:
+            return None
+
+        return self.distance_gc / self._distance
+
+    @property
+    def speed_ground_avg(self):
+        """Mean airborne ground speed, in meters/second."""
+        if not self._n_speed:
+            return None
+
+        return self._speed_mean
+
+    def update(self, lon, lat, alt_msl, speed_ground, airborne=True):
+        """
+        Fold a new aircraft position into the accumulators.
+
+        Parameters
+        ----------
+        lon : float
+            Longitude, in decimal degrees.
+        lat : float
+            Latitude, in decimal degrees.
+        alt_msl : float
+            Altitude MSL, in meters.
+        speed_ground : float
+            Ground speed, in meters/second.
+        airborne : bool, optional
+            Whether the aircraft is in the air. Only airborne positions count
+            towards the statistics.
+
+        Returns
+        -------
+        None.
+        """
+        if not airborne:
+            self._prev_airborne = None
+            return
+
+        if self._first is None:
+            self._first = (lon, lat)
+        self._last = (lon, lat)
+
+        if self._prev_airborne is not None:
+            self._distance += haversine(*self._prev_airborne, lon, lat)
+        self._prev_airborne = (lon, lat)
+
+        if self._alt_max is None or alt_msl > self._alt_max:
+            self._alt_max = alt_msl
+        if self._alt_min is None or alt_msl < self._alt_min:
+            self._alt_min = alt_msl
+
+        self._n_speed += 1
+        self._speed_mean += (speed_ground - self._speed_mean) / self._n_speed
@@ -0,0 +1,378 @@
+"""
+scheduler.py
+
+Cooperative task scheduler driven by a single flight loop callback.
+
+Notes
+-----
+* Tasks are run in priority order (lowest value first) whenever their
+  period has elapsed.
+* Each frame has a time budget, in microseconds. Once it is spent, the
+  remaining non-critical tasks that are due are deferred to a later frame.
+  Critical tasks always run, and a task deferred max_deferrals frames in a
+  row runs regardless of the budget, so it can't be starved.
+* A frame whose tasks took longer than the budget is counted as an overrun.
+  Frame & overrun counts are included in stats() and logged when a plugin
+  removes its tasks.
+* All plugins share one scheduler (see get_scheduler()) and one task table.
+  The sim ties flight loop callbacks to the plugin that registers them, so
+  each owner registers its own callback; the first one called in a flight
+  loop cycle runs the tasks and the others return straight away. Stopping
+  one plugin therefore never leaves the other plugins' tasks without a
+  callback.
+* Tasks run on either the wall clock or the sim clock. Sim clock periods are
+  in seconds of sim/time/total_flight_time_sec, which already advances at
+  the sim speed multiplier, so a sim clock task keeps a constant density in
+  simulated time under time acceleration. Sim clock tasks don't run while
+  the sim is paused, and if a frame covers several periods they're called
+  once with every missed sample time so they can catch up in one batch.
+"""
+import time
+import traceback
+
+from XPPython3 import xp
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 10
+PRIORITY_LOW = 20
+
+CLOCK_WALL = 'wall'
+CLOCK_SIM = 'sim'
+
+
+class Task:
+    """
+    A unit of work run by the scheduler.
+
+    Parameters
+    ----------
+    name : str
+        Unique task name.
+    func : callable
+        Called when the task runs. Wall clock tasks are called with no
+        arguments; sim clock tasks are called with a list of the sim times
+        the task was due at, oldest first.
+    period : float
+        Seconds between runs. 0 runs the task on every frame.
+    priority : int
+        Tasks with lower values run first.
+    critical : bool
+        Critical tasks are never deferred.
+    owner : str
+        Plugin that registered the task.
+    clock : str
+        CLOCK_WALL or CLOCK_SIM.
+    max_catch_up : int
+        Most sample times passed to a sim clock task in one call.
+    """
+
+    def __init__(self, name, func, period, priority, critical, owner,
+                 clock=CLOCK_WALL, max_catch_up=10):
+        self.name = name
+        self.func = func
+        self.period = period
+        self.priority = priority
+        self.critical = critical
+        self.owner = owner
+        self.clock = clock
+        self.max_catch_up = max_catch_up
+
+        self.next_due = None
+        self.runs = 0
+        self.deferrals = 0
+        self.deferred = 0
+        self.errors = 0
+        self.max_us = 0
+
+
+class Scheduler:
+    """
+    Run registered tasks from a single flight loop callback, within a
+    per-frame time budget.
+
+    Parameters
+    ----------
+    budget_us : int, optional
+        Per-frame time budget, in microseconds. Default is 2000.
+    max_deferrals : int, optional
+        Consecutive frames a due non-critical task can be deferred before it
+        is run regardless of the budget. Default is 10.
+    """
+
+    def __init__(self, budget_us=2000, max_deferrals=10):
+        self.budget_us = budget_us
+        self.max_deferrals = max_deferrals
+
+        self._tasks = []
+        self._registered = set()
+        self._cycle = None
+        self._frames = 0
+        self._overruns = 0
+
+        self._sim_time_ref = None
+        self._paused_ref = None
+        self._sim_time = None
+        self._paused = False
+
+    @property
+    def frames(self):
+        return self._frames
+
+    @property
+    def overruns(self):
+        return self._overruns
+
+    @property
+    def paused(self):
+        return self._paused
+
+    @property
+    def sim_time(self):
+        return self._sim_time
+
+    @property
+    def tasks(self):
+        return list(self._tasks)
+
+    def add_task(self, name, func, period=0.0, priority=PRIORITY_NORMAL,
+                 critical=False, owner=None, clock=CLOCK_WALL,
+                 max_catch_up=10):
+        """
+        Register a task. Registers a flight loop callback for the owner if
+        this is its first task, so call it from the owner plugin.
+
+        Parameters
+        ----------
+        name : str
+            Unique task name.
+        func : callable
+            Called when the task runs, see Task.
+        period : float, optional
+            Seconds between runs, on the task's clock. Default is 0, i.e.
+            every frame.
+        priority : int, optional
+            Tasks with lower values run first. Default is PRIORITY_NORMAL.
+        critical : bool, optional
+            If True, the task always runs when due, even if the frame budget
+            is spent. Default is False.
+        owner : str, optional
+            Plugin registering the task, for use with remove_owner().
+        clock : str, optional
+            CLOCK_WALL (default) or CLOCK_SIM.
+        max_catch_up : int, optional
+            Most sample times passed to a sim clock task in one call. If
+            more periods were missed, only the latest are kept. Default
+            is 10.
+
+        Returns
+        -------
+        Task
+        """
+        if any(task.name == name for task in self._tasks):
+            raise ValueError(f'Task {name} is already registered')
+        if clock not in (CLOCK_WALL, CLOCK_SIM):
+            raise ValueError(f'Invalid clock {clock}')
+
+        task = Task(name, func, period, priority, critical, owner, clock,
+                    max_catch_up)
+        self._tasks.append(task)
+        self._tasks.sort(key=lambda t: (not t.critical, t.priority))
+
+        if owner not in self._registered:
+            xp.registerFlightLoopCallback(self.flight_loop, -1, owner)
+            self._registered.add(owner)
+
+        return task
+
+    def remove_task(self, name):
+        """
+        Unregister a task by name.
+
+        Parameters
+        ----------
+        name : str
+
+        Returns
+        -------
+        None.
+        """
+        self._tasks = [t for t in self._tasks if t.name != name]
+        self._unregister_idle()
+
+    def remove_owner(self, owner):
+        """
+        Unregister all tasks registered by a plugin, and log their run
+        statistics. Call it from the owner plugin.
+
+        Parameters
+        ----------
+        owner : str
+
+        Returns
+        -------
+        None.
+        """
+        stats = self.stats()
+        tasks = [t for t in self._tasks if t.owner == owner]
+        if tasks:
+            print(f'Scheduler: {stats["frames"]} frames, '
+                  f'{stats["overruns"]} over the {self.budget_us} us budget')
+            for t in tasks:
+                print(f'Scheduler: {t.name}: {stats["tasks"][t.name]}')
+
+        self._tasks = [t for t in self._tasks if t.owner != owner]
+        self._unregister_idle()
+
+    def stats(self):
+        """
+        Run statistics.
+
+        Returns
+        -------
+        dict
+            'frames' & 'overruns' counts, and 'tasks': task name -> dict of
+            runs, deferrals, errors & max run time in microseconds.
+        """
+        return {
+            'frames': self._frames,
+            'overruns': self._overruns,
+            'tasks': {
+                t.name: {
+                    'runs': t.runs,
+                    'deferrals': t.deferrals,
+                    'errors': t.errors,
+                    'max_us': t.max_us,
+                }
+                for t in self._tasks
+            },
+        }
+
+    def flight_loop(self, elapsedMe, elapsedSim, counter, refcon):
+        """
+        Flight loop callback. Runs the tasks that are due, once per flight
+        loop cycle however many owners have a callback registered.
+
+        Returns
+        -------
+        int
+            -1, to be called again on the next flight loop.
+        """
+        if counter == self._cycle:
+            return -1
+        self._cycle = counter
+
+        wall_now = time.monotonic()
+        start_ns = time.perf_counter_ns()
+        budget_ns = self.budget_us * 1000
+        self._frames += 1
+        sim_now = self._read_sim_clock()
+
+        # Critical tasks are sorted first, so every critical task has run by
+        # the time the budget can cause a deferral.
+        for task in list(self._tasks):
+            if task.clock == CLOCK_SIM:
+                if self._paused:
+                    continue
+                now = sim_now
+            else:
+                now = wall_now
+
+            if task.next_due is None:
+                task.next_due = now
+            if now < task.next_due:
+                continue
+
+            task_start = time.perf_counter_ns()
+            if (not task.critical and task_start - start_ns >= budget_ns and
+                    task.deferred < self.max_deferrals):
+                task.deferrals += 1
+                task.deferred += 1
+                continue
+            task.deferred = 0
+
+            if task.clock == CLOCK_SIM:
+                args = (self._due_times(task, now),)
+            else:
+                args = ()
+                # Schedule from the time the task was due rather than from
+                # now, so periodic tasks don't drift, unless it has fallen a
+                # whole period behind.
+                task.next_due += task.period
+                if task.next_due <= now:
+                    task.next_due = now + task.period
+
+            try:
+                task.func(*args)
+            except Exception:
+                task.errors += 1
+                traceback.print_exc()
+
+            task.runs += 1
+            task.max_us = max(
+                task.max_us, (time.perf_counter_ns() - task_start) // 1000)
+
+        if time.perf_counter_ns() - start_ns > budget_ns:
+            self._overruns += 1
+
+        return -1
+
+    def _read_sim_clock(self):
+        if self._sim_time_ref is None:
+            self._sim_time_ref = xp.findDataRef(
+                "sim/time/total_flight_time_sec")
+            self._paused_ref = xp.findDataRef("sim/time/paused")
+
+        sim_now = xp.getDataf(self._sim_time_ref)
+        self._paused = xp.getDatai(self._paused_ref) != 0
+
+        if self._sim_time is not None and sim_now < self._sim_time:
+            # Sim time went backwards: a new flight was started.
+            for task in self._tasks:
+                if task.clock == CLOCK_SIM:
+                    task.next_due = None
+        self._sim_time = sim_now
+
+        return sim_now
+
+    @staticmethod
+    def _due_times(task, now):
+        """
+        Sample times a sim clock task is due at, up to now, and advance its
+        next due time past them.
+        """
+        if task.period <= 0:
+            task.next_due = now
+            return [now]
+
+        missed = int((now - task.next_due) // task.period) + 1
+        skipped = max(0, missed - task.max_catch_up)
+        first = task.next_due + skipped * task.period
+
+        times = [first + i * task.period for i in range(missed - skipped)]
+        task.next_due += missed * task.period
+
+        return times
+
+    def _unregister_idle(self):
+        owners = {t.owner for t in self._tasks}
+        for owner in self._registered - owners:
+            xp.unregisterFlightLoopCallback(self.flight_loop, owner)
+            self._registered.discard(owner)
+
+
+_scheduler = None
+
+
+def get_scheduler():
+    """
+    Scheduler shared by all plugins.
+
+    Returns
+    -------
+    Scheduler
+    """
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = Scheduler()
+
+    return _scheduler
@@ -0,0 +1,252 @@
+"""
+shm_ring.py
+
+Shared-memory ring buffer of live track samples, for zero-copy consumers in
+other processes on the same machine.
+
+Notes
+-----
+* Layout: a 64 byte header followed by `capacity` fixed-size records (see
+  RECORD_DTYPE). The header holds a magic number, the layout version, the
+  capacity, the record size and the write sequence counter, i.e. the total
+  number of records ever written.
+* The writer fills a record, then bumps the sequence counter. Readers compare
+  the counter to the last value they saw and get the new records as NumPy
+  views straight into shared memory: no copies and no syscalls per record.
+* A reader that falls more than `capacity` records behind loses the oldest
+  ones. Each record carries its own sequence number so readers can also
+  detect a record that was overwritten while they were reading it.
+* On POSIX, creating the block registers it with multiprocessing's resource
+  tracker, which runs as a separate process launched with the executable
+  multiprocessing is configured to use (sys.executable by default). In an
+  embedded interpreter, such as XPPython3 inside X-Plane, sys.executable is
+  the host application, not Python, so call multiprocessing.set_executable()
+  with the real interpreter before creating a TrackRingWriter.
+"""
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+MAGIC = b'XPTR'
+VERSION = 1
+HEADER_SIZE = 64
+
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S4'),
+    ('version', '<u4'),
+    ('capacity', '<u4'),
+    ('record_size', '<u4'),
+    ('write_seq', '<u8'),
+])
+
+# Blocks created by a TrackRingWriter in this process
+_created = set()
+
+RECORD_DTYPE = np.dtype([
+    ('seq', '<u8'),
+    ('time', '<f8'),
+    ('lat', '<f8'),
+    ('lon', '<f8'),
+    ('alt_msl', '<f4'),
+    ('alt_agl', '<f4'),
+    ('speed_ground', '<f4'),
+    ('speed_ias', '<f4'),
+    ('speed_vertical', '<f4'),
+    ('on_ground', 'u1'),
+    ('_pad', 'u1', (3,)),
+])
+
+
+class TrackRingWriter:
+    """
+    Create a shared-memory track ring and publish samples into it.
+
+    Parameters
+    ----------
+    name : str, optional
+        Shared memory block name. Default is 'xp_tracklog'.
+    capacity : int, optional
+        Number of records in the ring. Default is 65536.
+    """
+
+    def __init__(self, name='xp_tracklog', capacity=65536):
+        size = HEADER_SIZE + capacity * RECORD_DTYPE.itemsize
+        try:
+            self._shm = SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # Left behind by a previous session that didn't shut down cleanly
+            stale = SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            self._shm = SharedMemory(name=name, create=True, size=size)
+        _created.add(self._shm.name)
+
+        self._capacity = capacity
+        self._seq = 0
+
+        self._header = np.ndarray((), dtype=HEADER_DTYPE, buffer=self._shm.buf)
+        self._header['magic'] = MAGIC
+        self._header['version'] = VERSION
+        self._header['capacity'] = capacity
+        self._header['record_size'] = RECORD_DTYPE.itemsize
+        self._header['write_seq'] = 0
+
+        self._records = np.ndarray(
+            (capacity,), dtype=RECORD_DTYPE, buffer=self._shm.buf,
+            offset=HEADER_SIZE)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def write(self, time, lat, lon, alt_msl, alt_agl, speed_ground,
+              speed_ias, speed_vertical, on_ground):
+        """
+        Append a sample to the ring.
+
+        Parameters
+        ----------
+        time : float
+            Sim flight time, in seconds.
+        lat, lon : float
+            Decimal degrees.
+        alt_msl, alt_agl : float
+            Meters.
+        speed_ground : float
+            Meters/second.
+        speed_ias : float
+            Knots.
+        speed_vertical : float
+            Feet/minute.
+        on_ground : bool
+
+        Returns
+        -------
+        None.
+        """
+        seq = self._seq
+        self._records[seq % self._capacity] = (
+            seq, time, lat, lon, alt_msl, alt_agl, speed_ground, speed_ias,
+            speed_vertical, on_ground, 0)
+
+        # Publish only once the record is complete
+        self._seq = seq + 1
+        self._header['write_seq'] = self._seq
+
+    def close(self):
+        """
+        Release & remove the shared memory block.
+
+        Returns
+        -------
+        None.
+        """
+        if self._shm is None:
+            return
+
+        # The views must be released before the block can be closed
+        self._header = None
+        self._records = None
+        _created.discard(self._shm.name)
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
+
+
+class TrackRingReader:
+    """
+    Attach to a shared-memory track ring created by TrackRingWriter.
+
+    Parameters
+    ----------
+    name : str, optional
+        Shared memory block name. Default is 'xp_tracklog'.
+    from_start : bool, optional
+        If True, the first poll() returns every record still in the ring.
+        Default is False, i.e. only records written after attaching.
+    """
+
+    def __init__(self, name='xp_tracklog', from_start=False):
+        # Attaching must not make this process responsible for removing the
+        # block when it exits; the writer owns it.
+        try:
+            self._shm = SharedMemory(name=name, track=False)
+        except TypeError:
+            # Python < 3.13: attaching registers the block with the resource
+            # tracker, so undo that, unless the writer is in this process and
+            # the registration is its own.
+            self._shm = SharedMemory(name=name)
+            if self._shm.name not in _created:
+                resource_tracker.unregister(
+                    self._shm._name, 'shared_memory')
+
+        self._header = np.ndarray((), dtype=HEADER_DTYPE, buffer=self._shm.buf)
+        if self._header['magic'] != MAGIC:
+            raise ValueError(f'{name} is not a track ring')
+        if self._header['version'] != VERSION:
+            raise ValueError(
+                f'Unsupported track ring version {self._header["version"]}')
+        if self._header['record_size'] != RECORD_DTYPE.itemsize:
+            raise ValueError('Track ring record size mismatch')
+
+        self._capacity = int(self._header['capacity'])
+        self._records = np.ndarray(
+            (self._capacity,), dtype=RECORD_DTYPE, buffer=self._shm.buf,
+            offset=HEADER_SIZE)
+
+        self._next = 0 if from_start else int(self._header['write_seq'])
+        self._lost = 0
+
+    @property
+    def lost(self):
+        """Number of records overwritten before this reader saw them."""
+        return self._lost
+
+    def poll(self):
+        """
+        Get the records written since the last call.
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            Zero, one or two views into the ring, oldest records first. Two
+            views are returned when the new records wrap around the end of
+            the ring. The views are only valid until the writer laps them, so
+            copy anything that needs to be kept.
+        """
+        end = int(self._header['write_seq'])
+        start = self._next
+        if end - start > self._capacity:
+            self._lost += end - self._capacity - start
+            start = end - self._capacity
+        self._next = end
+
+        if start == end:
+            return ()
+
+        i_start = start % self._capacity
+        i_end = end % self._capacity
+        if i_start < i_end:
+            return (self._records[i_start:i_end],)
+
+        if i_end == 0:
+            return (self._records[i_start:],)
+
+        return self._records[i_start:], self._records[:i_end]
+
+    def close(self):
+        """
+        Detach from the shared memory block.
+
+        Returns
+        -------
+        None.
+        """
+        if self._shm is None:
+            return
+
+        self._header = None
+        self._records = None
+        self._shm.close()
+        self._shm = None
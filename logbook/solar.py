@@ -0,0 +1,176 @@
+"""
+solar.py
+
+Analytic solar position, used to classify flight time & landings as day or
+night without depending on the live sim.
+
+Notes
+-----
+* Sun elevation uses the NOAA fractional-year approximation for the
+  equation of time & solar declination, which is accurate to a few tenths
+  of a degree; plenty for day/night classification.
+* Every function accepts scalars or NumPy arrays, and arrays are processed
+  in a single vectorized pass.
+* Night is taken as the end of evening civil twilight to the beginning of
+  morning civil twilight, i.e. the sun more than 6 degrees below the
+  horizon.
+* day_of_year is zero-based (January 1 is day 0), like the sim's
+  sim/time/local_date_days dataref.
+"""
+import numpy as np
+
+from logbook.track_file import read_columns
+
+NIGHT_ELEVATION = -6.0
+
+
+def solar_elevation(lat, lon, day_of_year, utc_seconds):
+    """
+    Elevation of the sun above the horizon.
+
+    Parameters
+    ----------
+    lat : float or numpy.ndarray
+        Latitude, in decimal degrees.
+    lon : float or numpy.ndarray
+        Longitude, in decimal degrees. East is positive.
+    day_of_year : int or numpy.ndarray
+        Zero-based day of the year.
+    utc_seconds : float or numpy.ndarray
+        UTC time, in seconds since midnight.
+
+    Returns
+    -------
+    numpy.ndarray
+        Sun elevation, in degrees.
+    """
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.asarray(lon, dtype=np.float64)
+    day_of_year = np.asarray(day_of_year, dtype=np.float64)
+    utc_minutes = np.asarray(utc_seconds, dtype=np.float64) / 60.0
+
+    # Fractional year, in radians
+    gamma = (2 * np.pi / 365.0) * (
+        day_of_year + (utc_minutes / 60.0 - 12) / 24)
+
+    cos_g, sin_g = np.cos(gamma), np.sin(gamma)
+    cos_2g, sin_2g = np.cos(2 * gamma), np.sin(2 * gamma)
+
+    # Equation of time, in minutes
+    eq_time = 229.18 * (0.000075 + 0.001868 * cos_g - 0.032077 * sin_g -
+                        0.014615 * cos_2g - 0.040849 * sin_2g)
+
+    # Solar declination, in radians
+    decl = (0.006918 - 0.399912 * cos_g + 0.070257 * sin_g -
+            0.006758 * cos_2g + 0.000907 * sin_2g -
+            0.002697 * np.cos(3 * gamma) + 0.00148 * np.sin(3 * gamma))
+
+    true_solar_minutes = utc_minutes + eq_time + 4.0 * lon
+    hour_angle = np.radians(true_solar_minutes / 4.0 - 180.0)
+
+    cos_zenith = (np.sin(lat) * np.sin(decl) +
+                  np.cos(lat) * np.cos(decl) * np.cos(hour_angle))
+
+    return 90.0 - np.degrees(np.arccos(np.clip(cos_zenith, -1.0, 1.0)))
+
+
+def is_night(lat, lon, day_of_year, utc_seconds):
+    """
+    Is it night at the given position(s) & time(s)?
+
+    Parameters
+    ----------
+    lat, lon, day_of_year, utc_seconds
+        See solar_elevation().
+
+    Returns
+    -------
+    numpy.ndarray of bool
+    """
+    elevation = solar_elevation(lat, lon, day_of_year, utc_seconds)
+
+    return elevation < NIGHT_ELEVATION
+
+
+def night_time(lat, lon, day_of_year, utc_seconds):
+    """
+    Total night time along a track. Each interval between two consecutive
+    points is classified by the sun elevation at its start.
+
+    Parameters
+    ----------
+    lat, lon, day_of_year, utc_seconds : numpy.ndarray
+        Track points, in chronological order. See solar_elevation().
+
+    Returns
+    -------
+    float
+        Night time, in seconds.
+    """
+    utc_seconds = np.asarray(utc_seconds, dtype=np.float64)
+    if utc_seconds.size < 2:
+        return 0.0
+
+    dt = np.diff(utc_seconds)
+    # Crossing midnight UTC
+    dt[dt < 0] += 24 * 3600
+
+    night = is_night(lat, lon, day_of_year, utc_seconds)[:-1]
+
+    return float(dt[night].sum())
+
+
+def night_landings(lat, lon, day_of_year, utc_seconds, on_ground):
+    """
+    Number of landings made at night along a track. A landing is a point
+    where the aircraft is on the ground and was airborne at the previous
+    point.
+
+    Parameters
+    ----------
+    lat, lon, day_of_year, utc_seconds : numpy.ndarray
+        Track points, in chronological order. See solar_elevation().
+    on_ground : numpy.ndarray of bool
+        Whether the aircraft was on the ground at each point.
+
+    Returns
+    -------
+    int
+    """
+    on_ground = np.asarray(on_ground, dtype=bool)
+    touchdown = np.zeros(on_ground.shape, dtype=bool)
+    touchdown[1:] = on_ground[1:] & ~on_ground[:-1]
+    if not touchdown.any():
+        return 0
+
+    lat, lon, day_of_year, utc_seconds = (
+        np.broadcast_to(x, touchdown.shape)[touchdown]
+        for x in (lat, lon, day_of_year, utc_seconds))
+
+    return int(is_night(lat, lon, day_of_year, utc_seconds).sum())
+
+
+def classify_track(track_file):
+    """
+    Night time & night landings of a track file written by PI_TrackLog.
+
+    Parameters
+    ----------
+    track_file : pathlib.Path
+
+    Returns
+    -------
+    float, int
+        Night time in hours, and number of night landings.
+    """
+    track = read_columns(
+        track_file,
+        ['currLat', 'currLon', 'currDay', 'currZuluSec', 'currOnGround'])
+
+    columns = (track['currLat'], track['currLon'], track['currDay'],
+               track['currZuluSec'])
+
+    night_hours = night_time(*columns) / 3600
+    landings = night_landings(*columns, track['currOnGround'].astype(bool))
+
+    return round(night_hours, 2), landings
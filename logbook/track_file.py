@@ -0,0 +1,36 @@
+"""
+track_file.py
+
+Helpers for reading track files written by PI_TrackLog.
+"""
+import numpy as np
+
+
+def read_columns(track_file, columns):
+    """
+    Read numeric columns of a track file.
+
+    Parameters
+    ----------
+    track_file : pathlib.Path
+    columns : list of str
+        Names of the columns to read, as in the file's header line.
+
+    Returns
+    -------
+    numpy structured array
+        One float field per column. Empty fields are read as NaN.
+    """
+    with open(track_file) as f_in:
+        header = f_in.readline().strip().split(',')
+
+    missing = [c for c in columns if c not in header]
+    if missing:
+        raise ValueError(f'{track_file} has no columns {missing}')
+
+    track = np.genfromtxt(
+        track_file, delimiter=',', skip_header=1, dtype=np.float64,
+        usecols=[header.index(c) for c in columns], names=list(columns),
+        filling_values=np.nan)
+
+    return np.atleast_1d(track)
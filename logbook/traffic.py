@@ -0,0 +1,156 @@
+"""
+traffic.py
+
+Multi-aircraft (AI/multiplayer) track logger. Positions of every other
+aircraft in the sim are read into columnar NumPy arrays and converted from
+local OpenGL coordinates to lat/lon/altitude in one vectorized pass.
+
+Notes
+-----
+* When the TCAS target array datarefs are available (X-Plane 11.50+), the
+  x/y/z coordinates of all planes are read with one SDK call per axis.
+  Otherwise the sim/multiplayer/position/planeN_x/y/z datarefs are read.
+* X-Plane's local coordinates have their origin at the current reference
+  point, with +x pointing east, +y up and -z north. The conversion below
+  treats that frame as a plane tangent to the Earth at the reference point
+  and corrects the altitude for the Earth's curvature. Only the reference
+  point itself goes through xp.localToWorld(), and only when it moves.
+* Track file columns: sim zulu time (seconds since midnight), plane index,
+  latitude, longitude (decimal degrees) & altitude MSL (feet).
+"""
+import numpy as np
+
+from XPPython3 import xp
+
+
+class TrafficTracker:
+    """
+    Record the positions of all AI/multiplayer aircraft to a single file.
+
+    Parameters
+    ----------
+    output_file : pathlib.Path
+        Track file to write.
+    """
+    MAX_PLANES = 63
+    EARTH_RADIUS_M = 6378145.0
+
+    def __init__(self, output_file):
+        self._output_file = output_file
+        self._f_out = None
+
+        self._tcas_refs = [
+            xp.findDataRef(f"sim/cockpit2/tcas/targets/position/{axis}")
+            for axis in ("x", "y", "z")]
+        self._batched = all(self._tcas_refs)
+
+        self._plane_refs = []
+        if not self._batched:
+            self._plane_refs = [
+                [xp.findDataRef(f"sim/multiplayer/position/plane{i}_{axis}")
+                 for i in range(1, self.MAX_PLANES + 1)]
+                for axis in ("x", "y", "z")]
+
+        self._lat_ref = xp.findDataRef("sim/flightmodel/position/lat_ref")
+        self._lon_ref = xp.findDataRef("sim/flightmodel/position/lon_ref")
+        self._zulu_ref = xp.findDataRef("sim/time/zulu_time_sec")
+        self._ref_point = None
+        self._origin = None
+
+        self._values = [0.0] * self.MAX_PLANES
+        self._xyz = np.zeros((3, self.MAX_PLANES), dtype=np.float64)
+        self._index = np.arange(1, self.MAX_PLANES + 1)
+
+    def sample(self):
+        """
+        Read the position of every active AI/multiplayer aircraft and append
+        it to the track file.
+
+        Returns
+        -------
+        int
+            Number of aircraft recorded.
+        """
+        _, n_active, _ = xp.countAircraft()
+        n_planes = min(n_active - 1, self.MAX_PLANES)
+        if n_planes <= 0:
+            return 0
+
+        self._read_local(n_planes)
+        x, y, z = self._xyz[:, :n_planes]
+        lat, lon, alt = self.local_to_world(x, y, z)
+
+        zulu = xp.getDataf(self._zulu_ref)
+        rows = np.column_stack((
+            np.full(n_planes, zulu), self._index[:n_planes],
+            lat, lon, alt * 3.28084))
+        self._write(rows)
+
+        return n_planes
+
+    def close(self):
+        """
+        Close the track file.
+
+        Returns
+        -------
+        None.
+        """
+        if self._f_out is not None:
+            self._f_out.close()
+            self._f_out = None
+
+    def local_to_world(self, x, y, z):
+        """
+        Convert arrays of local OpenGL coordinates to world coordinates.
+
+        Parameters
+        ----------
+        x, y, z : numpy.ndarray
+            Local coordinates, in meters.
+
+        Returns
+        -------
+        numpy.ndarray, numpy.ndarray, numpy.ndarray
+            Latitude & longitude in decimal degrees, and altitude MSL in
+            meters.
+        """
+        lat0, lon0, alt0 = self._reference_origin()
+
+        north = -z
+        east = x
+        radius = self.EARTH_RADIUS_M
+
+        lat = lat0 + np.degrees(north / radius)
+        lon = lon0 + np.degrees(east / (radius * np.cos(np.radians(lat0))))
+        alt = alt0 + y + (east * east + north * north) / (2 * radius)
+
+        return lat, lon, alt
+
+    def _reference_origin(self):
+        ref_point = (xp.getDataf(self._lat_ref), xp.getDataf(self._lon_ref))
+        if ref_point != self._ref_point:
+            self._ref_point = ref_point
+            self._origin = xp.localToWorld(0.0, 0.0, 0.0)
+
+        return self._origin
+
+    def _read_local(self, n_planes):
+        values = self._values
+        for axis in range(3):
+            if self._batched:
+                # Index 0 of the TCAS target arrays is the user aircraft.
+                xp.getDatavf(self._tcas_refs[axis], values, 1, n_planes)
+                self._xyz[axis, :n_planes] = values[:n_planes]
+            else:
+                refs = self._plane_refs[axis]
+                self._xyz[axis, :n_planes] = [
+                    xp.getDatad(refs[i]) for i in range(n_planes)]
+
+    def _write(self, rows):
+        if self._f_out is None:
+            self._output_file.parent.mkdir(parents=True, exist_ok=True)
+            self._f_out = open(self._output_file, 'w')
+            self._f_out.write('time,plane,lat,lon,alt_ft\n')
+
+        np.savetxt(self._f_out, rows, fmt='%.1f,%d,%.6f,%.6f,%.0f')